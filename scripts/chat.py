@@ -3,12 +3,29 @@
 可被 UI 直接導入使用，或作為獨立 CLI 工具運行
 """
 import os
+import re
 import sys
+import copy
+import hashlib
+import weakref
+import threading
 import torch
 import argparse
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import (
+    AutoTokenizer,
+    AutoModelForCausalLM,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
 from peft import PeftModel
+from peft.tuners.tuners_utils import BaseTunerLayer
+
+from response_cache import ResponseCache
 
 # 動態獲取專案根目錄
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
@@ -31,6 +48,35 @@ SYSTEM_PROMPTS = {
 }
 
 
+def format_qwen_system_prefix(system_prompt: str) -> str:
+    """
+    格式化 Qwen system 區塊（所有對話共用的前綴）
+    
+    Args:
+        system_prompt: 系統提示
+    
+    Returns:
+        `<|im_start|>system ... <|im_end|>` 前綴文本
+    """
+    return "<|im_start|>system\n" + system_prompt + "\n<|im_end|>\n"
+
+
+def format_qwen_user_turn(user_msg: str) -> str:
+    """
+    格式化 Qwen user 回合，並接上 assistant 起始標記
+    
+    Args:
+        user_msg: 用戶訊息
+    
+    Returns:
+        user 回合文本（以 assistant 起始標記結尾）
+    """
+    return (
+        f"<|im_start|>user\n{user_msg}\n<|im_end|>\n"
+        + "<|im_start|>assistant\n"
+    )
+
+
 def format_qwen_single_turn(user_msg: str, system_prompt: str) -> str:
     """
     格式化 Qwen 單輪對話提示
@@ -42,14 +88,276 @@ def format_qwen_single_turn(user_msg: str, system_prompt: str) -> str:
     Returns:
         格式化的提示文本
     """
-    text = (
-        "<|im_start|>system\n" + system_prompt + "\n<|im_end|>\n"
-        + f"<|im_start|>user\n{user_msg}\n<|im_end|>\n"
-        + "<|im_start|>assistant\n"
-    )
+    text = format_qwen_system_prefix(system_prompt) + format_qwen_user_turn(user_msg)
     return text
 
 
+# ========== System prompt 前綴 KV cache ==========
+# {model: {(adapter, prefix_text): (prefix_ids, past_key_values)}}
+# 以 WeakKeyDictionary 綁定模型物件，模型被釋放時快取一併回收
+_PREFIX_KV_CACHE = weakref.WeakKeyDictionary()
+
+
+def _adapter_cache_key(model):
+    """
+    取得目前啟用的 LoRA adapter 名稱（非 PeftModel 則為 None）
+    
+    在 disable_adapter() 區塊內輸出等同 base 模型，此時回傳 None，
+    避免沿用套用 adapter 時算出的前綴 KV。
+    """
+    if not isinstance(model, PeftModel):
+        return None
+    for module in model.modules():
+        if isinstance(module, BaseTunerLayer):
+            if module.disable_adapters:
+                return None
+            break
+    return getattr(model, "active_adapter", None)
+
+
+def get_prefix_kv_cache(tokenizer, model, prefix_text: str):
+    """
+    取得前綴的 past_key_values，每組 (model, adapter, prefix) 只計算一次
+    
+    Args:
+        tokenizer: 分詞器
+        model: 模型
+        prefix_text: 前綴文本（通常為 format_qwen_system_prefix 的結果）
+    
+    Returns:
+        (prefix_ids, past_key_values)；past_key_values 使用前需先複製
+    """
+    per_model = _PREFIX_KV_CACHE.setdefault(model, {})
+    key = (_adapter_cache_key(model), prefix_text)
+    if key not in per_model:
+        prefix_ids = tokenizer(
+            prefix_text, return_tensors="pt", add_special_tokens=False
+        ).input_ids.to(model.device)
+        with torch.no_grad():
+            past_key_values = model(
+                input_ids=prefix_ids,
+                past_key_values=DynamicCache(),
+                use_cache=True,
+            ).past_key_values
+        per_model[key] = (prefix_ids, past_key_values)
+    return per_model[key]
+
+
+def clear_prefix_kv_cache(model=None, adapter_name: str = None):
+    """清除前綴 KV cache（不指定模型則全部清除；指定 adapter_name 時只清除該 adapter 的項目）"""
+    if model is None:
+        _PREFIX_KV_CACHE.clear()
+    elif adapter_name is None:
+        _PREFIX_KV_CACHE.pop(model, None)
+    else:
+        per_model = _PREFIX_KV_CACHE.get(model, {})
+        for key in [k for k in per_model if k[0] == adapter_name]:
+            del per_model[key]
+
+
+def _prepare_generate_inputs(tokenizer, model, prompt: str, prefix_text: str = None) -> dict:
+    """
+    準備 generate 的輸入；prompt 以 prefix_text 開頭時附上快取的前綴 KV
+    
+    Returns:
+        可直接展開給 model.generate 的 dict（含 input_ids / attention_mask，可能含 past_key_values）
+    """
+    if not prefix_text or not prompt.startswith(prefix_text):
+        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+        return dict(inputs)
+    
+    prefix_ids, prefix_cache = get_prefix_kv_cache(tokenizer, model, prefix_text)
+    # 前綴以 <|im_end|>\n 結尾、後段以特殊標記開頭，分開分詞與整段分詞結果一致
+    suffix_ids = tokenizer(
+        prompt[len(prefix_text):], return_tensors="pt", add_special_tokens=False
+    ).input_ids.to(model.device)
+    input_ids = torch.cat([prefix_ids, suffix_ids], dim=-1)
+    return {
+        "input_ids": input_ids,
+        "attention_mask": torch.ones_like(input_ids),
+        # generate 會就地擴充 cache，需複製一份以保留原始前綴
+        "past_key_values": copy.deepcopy(prefix_cache),
+    }
+
+
+def generate_with_prefix_cache(tokenizer, model, prompt: str, prefix_text: str, **gen_kwargs):
+    """
+    以快取的前綴 KV 執行 generate，只需對前綴之後的部分做 prefill
+    
+    Args:
+        tokenizer: 分詞器
+        model: 模型
+        prompt: 完整提示文本（必須以 prefix_text 開頭，否則退回一般 generate）
+        prefix_text: 共用前綴文本
+        **gen_kwargs: 傳給 model.generate 的參數
+    
+    Returns:
+        generate 輸出（包含前綴在內的完整序列）
+    """
+    inputs = _prepare_generate_inputs(tokenizer, model, prompt, prefix_text)
+    with torch.no_grad():
+        return model.generate(**inputs, **gen_kwargs)
+
+
+# ========== 停止條件與解碼 ==========
+# 回覆結束標記：<|im_end|> 與下一個角色的 <|im_start|>，以及 tokenizer 的結束標記
+DEFAULT_STOP_MARKERS = ["<|im_end|>", "<|im_start|>", "<|endoftext|>"]
+
+
+def build_stop_kwargs(tokenizer, stop_markers: list = None) -> dict:
+    """
+    建立 generate 的停止參數
+    
+    單一 token 的標記併入 eos_token_id（每列各自停止，無額外開銷），
+    被拆成多個 token 的標記則交給 stop_strings 處理。
+    
+    Args:
+        tokenizer: 分詞器
+        stop_markers: 停止標記（預設 DEFAULT_STOP_MARKERS）
+    
+    Returns:
+        可直接展開給 model.generate 的 dict
+    """
+    if stop_markers is None:
+        stop_markers = DEFAULT_STOP_MARKERS
+    
+    stop_ids = []
+    if tokenizer.eos_token_id is not None:
+        stop_ids.append(tokenizer.eos_token_id)
+    stop_strings = []
+    for marker in stop_markers:
+        ids = tokenizer.encode(marker, add_special_tokens=False)
+        if len(ids) == 1:
+            stop_ids.append(ids[0])
+        elif ids:
+            stop_strings.append(marker)
+    
+    stop_kwargs = {"eos_token_id": sorted(set(stop_ids))}
+    if stop_strings:
+        stop_kwargs["stop_strings"] = stop_strings
+        stop_kwargs["tokenizer"] = tokenizer
+    return stop_kwargs
+
+
+def decode_new_tokens(tokenizer, outputs, prompt_length: int, stop_markers: list = None) -> list:
+    """
+    只解碼 prompt 之後新生成的 token，並在第一個停止標記處截斷
+    
+    Args:
+        tokenizer: 分詞器
+        outputs: generate 輸出
+        prompt_length: prompt（含左側補齊）的 token 長度
+        stop_markers: 停止標記（預設 DEFAULT_STOP_MARKERS）
+    
+    Returns:
+        每列的回覆文字（已 strip）
+    """
+    if stop_markers is None:
+        stop_markers = DEFAULT_STOP_MARKERS
+    
+    replies = []
+    for seq in outputs[:, prompt_length:]:
+        text = tokenizer.decode(seq, skip_special_tokens=False)
+        hit = [text.index(m) for m in stop_markers if m in text]
+        if hit:
+            text = text[:min(hit)]
+        replies.append(text.strip())
+    return replies
+
+
+def _pad_token_id(tokenizer):
+    """取得 pad token id（未設定時沿用 eos）"""
+    if tokenizer.pad_token_id is not None:
+        return tokenizer.pad_token_id
+    return tokenizer.eos_token_id
+
+
+def _cache_params(stop_markers: list, gen_kwargs: dict) -> dict:
+    """回應快取鍵中的生成參數部分"""
+    return {**gen_kwargs, "stop_markers": stop_markers or DEFAULT_STOP_MARKERS}
+
+
+def _use_response_cache(response_cache, model, gen_kwargs: dict) -> bool:
+    return response_cache is not None and response_cache.is_cacheable(model, gen_kwargs)
+
+
+def generate_reply(tokenizer, model, prompt: str, prefix_text: str = None,
+                   stop_markers: list = None, response_cache=None, **gen_kwargs) -> str:
+    """
+    單題生成：前綴 KV 重用 + 遇停止標記即停 + 只解碼新 token
+    
+    Args:
+        tokenizer: 分詞器
+        model: 模型
+        prompt: 完整提示文本
+        prefix_text: 可快取的共用前綴（可選）
+        stop_markers: 停止標記（預設 DEFAULT_STOP_MARKERS）
+        response_cache: ResponseCache（可選，只在確定性生成時使用）
+        **gen_kwargs: 其餘 generate 參數（max_new_tokens、取樣設定等）
+    
+    Returns:
+        assistant 回覆文字
+    """
+    use_cache = _use_response_cache(response_cache, model, gen_kwargs)
+    if use_cache:
+        params = _cache_params(stop_markers, gen_kwargs)
+        cached = response_cache.get(prompt, params)
+        if cached is not None:
+            return cached
+
+    inputs = _prepare_generate_inputs(tokenizer, model, prompt, prefix_text)
+    generate_kwargs = {**build_stop_kwargs(tokenizer, stop_markers), **gen_kwargs}
+    generate_kwargs.setdefault("pad_token_id", _pad_token_id(tokenizer))
+    with torch.no_grad():
+        outputs = model.generate(**inputs, **generate_kwargs)
+    reply = decode_new_tokens(tokenizer, outputs, inputs["input_ids"].shape[-1], stop_markers)[0]
+
+    if use_cache:
+        response_cache.put(prompt, params, reply)
+    return reply
+
+
+def generate_reply_batch(tokenizer, model, prompts: list, stop_markers: list = None,
+                         response_cache=None, **gen_kwargs) -> list:
+    """
+    批次生成（tokenizer 需設定 padding_side="left"），回傳順序與輸入相同
+    
+    Args:
+        tokenizer: 分詞器
+        model: 模型
+        prompts: 完整提示文本列表
+        stop_markers: 停止標記（預設 DEFAULT_STOP_MARKERS）
+        response_cache: ResponseCache（可選，命中的題目不再送入模型）
+        **gen_kwargs: 其餘 generate 參數
+    
+    Returns:
+        每題的 assistant 回覆文字
+    """
+    replies = [None] * len(prompts)
+    use_cache = _use_response_cache(response_cache, model, gen_kwargs)
+    if use_cache:
+        params = _cache_params(stop_markers, gen_kwargs)
+        for i, prompt in enumerate(prompts):
+            replies[i] = response_cache.get(prompt, params)
+
+    pending = [i for i, reply in enumerate(replies) if reply is None]
+    if not pending:
+        return replies
+
+    inputs = tokenizer([prompts[i] for i in pending], return_tensors="pt", padding=True).to(model.device)
+    generate_kwargs = {**build_stop_kwargs(tokenizer, stop_markers), **gen_kwargs}
+    generate_kwargs.setdefault("pad_token_id", _pad_token_id(tokenizer))
+    with torch.no_grad():
+        outputs = model.generate(**inputs, **generate_kwargs)
+    decoded = decode_new_tokens(tokenizer, outputs, inputs["input_ids"].shape[-1], stop_markers)
+
+    for i, reply in zip(pending, decoded):
+        replies[i] = reply
+        if use_cache:
+            response_cache.put(prompts[i], params, reply)
+    return replies
+
+
 def load_chat_model(base_model_path: str, lora_path: str = None):
     """
     載入聊天模型（基礎模型 + 可選 LoRA）
@@ -62,16 +370,7 @@ def load_chat_model(base_model_path: str, lora_path: str = None):
         (tokenizer, model) 或 (None, None) 如果失敗
     """
     try:
-        print(f"📦 載入 Tokenizer...")
-        tokenizer = AutoTokenizer.from_pretrained(base_model_path, trust_remote_code=True)
-        
-        print(f"📦 載入基礎模型...")
-        base_model = AutoModelForCausalLM.from_pretrained(
-            base_model_path,
-            torch_dtype=torch.bfloat16,
-            device_map="auto",
-            trust_remote_code=True,
-        )
+        tokenizer, base_model = _load_base_model(base_model_path)
         
         # 如果提供了 LoRA 路徑，套用 LoRA
         if lora_path and Path(lora_path).exists():
@@ -89,7 +388,162 @@ def load_chat_model(base_model_path: str, lora_path: str = None):
         return None, None
 
 
-def chat_ask(tokenizer, model, user_msg: str, lang: str = "zh-TW") -> str:
+def _load_base_model(base_model_path: str):
+    """載入 tokenizer 與基礎模型（load_chat_model 與 AdapterPool 共用）"""
+    print(f"📦 載入 Tokenizer...")
+    tokenizer = AutoTokenizer.from_pretrained(base_model_path, trust_remote_code=True)
+    
+    print(f"📦 載入基礎模型...")
+    base_model = AutoModelForCausalLM.from_pretrained(
+        base_model_path,
+        torch_dtype=torch.bfloat16,
+        device_map="auto",
+        trust_remote_code=True,
+    )
+    return tokenizer, base_model
+
+
+def _param_bytes(params) -> int:
+    return sum(p.numel() * p.element_size() for p in params)
+
+
+# 同時常駐的 adapter 數量上限（v1–v4 × 三種語言時可視記憶體調整）
+DEFAULT_MAX_ADAPTERS = 4
+
+
+class AdapterPool:
+    """
+    LoRA adapter 池：常駐一個基礎模型，以具名 adapter 載入多個 LoRA，用 set_adapter 切換
+    
+    切換已載入的 adapter 不需重新載入權重；超過數量或記憶體上限時，
+    依最近使用順序（LRU）卸載最久未用的 adapter。
+    
+    set_adapter 會修改共用的模型；多個執行緒（如 UI 的各個 session）共用時，
+    切換與其後的 generate 須在 use() 的 with 區塊內一起完成。
+    """
+    
+    def __init__(self, base_model_path: str, max_adapters: int = DEFAULT_MAX_ADAPTERS,
+                 max_adapter_bytes: int = None):
+        """
+        Args:
+            base_model_path: 基礎模型路徑
+            max_adapters: 同時常駐的 adapter 數量上限
+            max_adapter_bytes: adapter 權重總大小上限（bytes，None 表示不限制）
+        """
+        self.base_model_path = base_model_path
+        self.max_adapters = max(1, max_adapters)
+        self.max_adapter_bytes = max_adapter_bytes
+        self.tokenizer, self.base_model = _load_base_model(base_model_path)
+        self.base_model.eval()
+        self.base_bytes = _param_bytes(self.base_model.parameters())
+        self.model = None                 # 第一次載入 adapter 後成為 PeftModel
+        self._adapters = OrderedDict()    # adapter_name -> {"path": ..., "bytes": ...}，最近使用的在最後
+        self._lock = threading.RLock()
+    
+    @staticmethod
+    def adapter_name(lora_path: str) -> str:
+        """由路徑產生 adapter 名稱（模組名稱不能含 "."，並以路徑雜湊區分不同語言的同名版本）"""
+        resolved = str(Path(lora_path).resolve())
+        digest = hashlib.sha1(resolved.encode("utf-8")).hexdigest()[:8]
+        return f"{re.sub(r'[^0-9A-Za-z_]', '_', Path(lora_path).name)}_{digest}"
+    
+    def _load_adapter(self, lora_path: str, name: str):
+        print(f"📦 載入 LoRA 適配器: {Path(lora_path).name}")
+        if self.model is None:
+            self.model = PeftModel.from_pretrained(self.base_model, lora_path, adapter_name=name)
+            self.model.eval()
+        else:
+            self.model.load_adapter(lora_path, adapter_name=name)
+        adapter_bytes = _param_bytes(
+            p for n, p in self.model.named_parameters() if f".{name}." in n
+        )
+        self._adapters[name] = {"path": str(lora_path), "bytes": adapter_bytes}
+    
+    def _evict(self, keep: str):
+        """依 LRU 卸載 adapter，直到回到數量與記憶體上限內（不卸載 keep）"""
+        while len(self._adapters) > 1:
+            over_count = len(self._adapters) > self.max_adapters
+            over_bytes = (self.max_adapter_bytes is not None
+                          and self.adapter_bytes > self.max_adapter_bytes)
+            if not (over_count or over_bytes):
+                break
+            name = next(n for n in self._adapters if n != keep)
+            print(f"🧹 卸載 LoRA 適配器: {Path(self._adapters[name]['path']).name}")
+            self.model.delete_adapter(name)
+            clear_prefix_kv_cache(self.model, name)
+            del self._adapters[name]
+    
+    def activate(self, lora_path: str = None):
+        """
+        切換到指定的 LoRA（None 表示只用基礎模型），必要時載入並淘汰舊的 adapter
+        
+        Args:
+            lora_path: LoRA 適配器路徑（可選）
+        
+        Returns:
+            (tokenizer, model)
+        """
+        with self._lock:
+            if not lora_path:
+                if self.model is None:
+                    return self.tokenizer, self.base_model
+                # adapter 已注入基礎模型的各層，改以停用 adapter 取得 base 輸出
+                self.model.base_model.disable_adapter_layers()
+                return self.tokenizer, self.model
+            
+            name = self.adapter_name(lora_path)
+            if name not in self._adapters:
+                self._load_adapter(lora_path, name)
+            self._adapters.move_to_end(name)
+            self.model.set_adapter(name)
+            self.model.base_model.enable_adapter_layers()
+            self._evict(keep=name)
+            return self.tokenizer, self.model
+    
+    @contextmanager
+    def use(self, lora_path: str = None):
+        """
+        獨占模型並切換到指定的 LoRA，with 區塊內的 generate 不會被其他執行緒切換 adapter
+        
+        Yields:
+            (tokenizer, model)
+        """
+        with self._lock:
+            yield self.activate(lora_path)
+    
+    @property
+    def adapter_bytes(self) -> int:
+        """目前常駐的 adapter 權重總大小"""
+        return sum(info["bytes"] for info in self._adapters.values())
+    
+    def loaded_adapters(self) -> list:
+        """目前常駐的 adapter 路徑（最久未用的在前）"""
+        return [info["path"] for info in self._adapters.values()]
+    
+    def describe(self) -> str:
+        """記憶體使用摘要"""
+        mb = 1024 * 1024
+        return (
+            f"基礎模型 {self.base_bytes / mb:.0f} MB，"
+            f"LoRA {len(self._adapters)}/{self.max_adapters} 個共 {self.adapter_bytes / mb:.1f} MB"
+        )
+
+
+# 聊天推理參數（eos/pad 依 tokenizer 另外指定）
+CHAT_GENERATION_KWARGS = dict(
+    max_new_tokens=300,
+    do_sample=False,
+    temperature=0.7,
+)
+
+def _resolve_system_prompt(lang) -> str:
+    """根據語言選擇系統提示（無效語言回退 zh-TW）"""
+    if not isinstance(lang, str) or lang not in SYSTEM_PROMPTS:
+        lang = "zh-TW"
+    return SYSTEM_PROMPTS[lang]
+
+
+def chat_ask(tokenizer, model, user_msg: str, lang: str = "zh-TW", response_cache=None) -> str:
     """
     執行聊天推理（Qwen 格式）
     
@@ -98,6 +552,7 @@ def chat_ask(tokenizer, model, user_msg: str, lang: str = "zh-TW") -> str:
         model: 模型
         user_msg: 用戶訊息
         lang: 語言代碼（en-US / zh-TW / zh-CN），決定系統提示
+        response_cache: ResponseCache（可選）
     
     Returns:
         AI 回覆
@@ -110,42 +565,20 @@ def chat_ask(tokenizer, model, user_msg: str, lang: str = "zh-TW") -> str:
         return "❌ 請輸入消息。"
     
     try:
-        # 根據語言選擇系統提示
-        if not isinstance(lang, str):
-            lang = "zh-TW"
-        
-        if lang not in SYSTEM_PROMPTS:
-            lang = "zh-TW"
-        
-        system_prompt = SYSTEM_PROMPTS.get(lang, SYSTEM_PROMPTS["zh-TW"])
+        system_prompt = _resolve_system_prompt(lang)
         
         prompt = format_qwen_single_turn(user_msg, system_prompt)
-        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-        
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=300,
-                do_sample=False,
-                temperature=0.7,
-                eos_token_id=tokenizer.eos_token_id,
-                pad_token_id=tokenizer.eos_token_id,
-            )
-        
-        decoded = tokenizer.decode(outputs[0], skip_special_tokens=False)
-        
-        # 只提取最後的 assistant 部分（跳過 system 和 user）
-        if "<|im_start|>assistant" in decoded:
-            # 取最後一個 assistant 之後的部分（確保只有 assistant 回應）
-            answer = decoded.split("<|im_start|>assistant")[-1]
-        else:
-            answer = decoded
-        
-        # 移除 <|im_end|> 及其之後的所有內容
-        if "<|im_end|>" in answer:
-            answer = answer.split("<|im_end|>")[0]
+        # 遇到 <|im_end|> 或角色標記即停止，且只解碼新生成的部分
+        answer = generate_reply(
+            tokenizer,
+            model,
+            prompt,
+            format_qwen_system_prefix(system_prompt),
+            response_cache=response_cache,
+            **CHAT_GENERATION_KWARGS,
+        )
         
-        # 清理所有特殊標記
+        # 清理殘留的特殊標記
         special_tokens = [
             "<|endoftext|>",
             "<|im_end|>",
@@ -169,14 +602,342 @@ def chat_ask(tokenizer, model, user_msg: str, lang: str = "zh-TW") -> str:
         return f"❌ 推理失敗：{str(e)}"
 
 
-def run_cli_interactive(base_model_path: str, lora_path: str = None, lang: str = "zh-TW"):
+class _CancelledCriteria(StoppingCriteria):
+    """當 cancel_event 被設定時中止 generate（串流消費端提早結束時使用）"""
+    
+    def __init__(self, cancel_event: threading.Event):
+        self.cancel_event = cancel_event
+    
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancel_event.is_set()
+
+
+def _stream_in_background(tokenizer, run_generate):
+    """
+    在背景執行緒執行 generate，逐段 yield 解碼後的文字
+    
+    Args:
+        tokenizer: 分詞器
+        run_generate: 執行 generate 的函式，需把收到的 streamer / stopping_criteria
+            關鍵字參數轉交給 model.generate
+    
+    Yields:
+        增量文字片段；遇到停止標記即結束
+    """
+    # 保留特殊標記，才能在 <|im_end|> 出現時判斷回覆結束
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=False)
+    cancel_event = threading.Event()
+    errors = []
+    
+    def _worker():
+        try:
+            run_generate(
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([_CancelledCriteria(cancel_event)]),
+            )
+        except Exception as e:
+            errors.append(e)
+            # 確保消費端不會永遠等待
+            streamer.end()
+    
+    thread = threading.Thread(target=_worker, daemon=True)
+    thread.start()
+    
+    emitted = False
+    try:
+        for text in streamer:
+            hit = [text.index(m) for m in DEFAULT_STOP_MARKERS if m in text]
+            if hit:
+                text = text[:min(hit)]
+            # 回覆開頭的空白不輸出（與 chat_ask 的 strip 行為一致）
+            if not emitted:
+                text = text.lstrip()
+            if text:
+                emitted = True
+                yield text
+            if hit:
+                break
+    finally:
+        # 提早結束（遇到結束標記或消費端中斷）時通知背景 generate 停止
+        cancel_event.set()
+        thread.join()
+    
+    if errors:
+        yield f"❌ 推理失敗：{str(errors[0])}"
+    elif not emitted:
+        yield "（無有效回應）"
+
+
+def chat_ask_stream(tokenizer, model, user_msg: str, lang: str = "zh-TW"):
+    """
+    串流版 chat_ask：在背景執行緒執行 generate，逐段 yield 解碼後的文字
+    
+    Args:
+        tokenizer: 分詞器
+        model: 模型
+        user_msg: 用戶訊息
+        lang: 語言代碼（en-US / zh-TW / zh-CN），決定系統提示
+    
+    Yields:
+        增量文字片段；串接後即為完整回覆
+    """
+    # 驗證輸入
+    if tokenizer is None or model is None:
+        yield "❌ 模型未加載，請先點擊 'Load Model' 按鈕。"
+        return
+    
+    if not user_msg or not user_msg.strip():
+        yield "❌ 請輸入消息。"
+        return
+    
+    system_prompt = _resolve_system_prompt(lang)
+    prompt = format_qwen_single_turn(user_msg, system_prompt)
+    
+    def _run(**stream_kwargs):
+        generate_with_prefix_cache(
+            tokenizer,
+            model,
+            prompt,
+            format_qwen_system_prefix(system_prompt),
+            **CHAT_GENERATION_KWARGS,
+            **build_stop_kwargs(tokenizer),
+            pad_token_id=_pad_token_id(tokenizer),
+            **stream_kwargs,
+        )
+    
+    yield from _stream_in_background(tokenizer, _run)
+
+
+# ========== 多輪對話 Session ==========
+# 預設上下文預算（token 數，含本輪預留的生成長度）
+DEFAULT_CONTEXT_BUDGET = 4096
+
+
+class ChatSession:
+    """
+    多輪對話 session：保留整段對話的 past_key_values，每輪只 prefill 新增的 token
+    
+    超出上下文預算時由最舊的回合開始淘汰，並以快取的 system 前綴重建 KV。
+    session 綁定建立時的模型與 adapter，切換模型或語言時應建立新的 session。
     """
-    運行交互式命令行聊天
+    
+    def __init__(self, tokenizer, model, lang: str = "zh-TW", system_prompt: str = None,
+                 max_context_tokens: int = DEFAULT_CONTEXT_BUDGET, stop_markers: list = None,
+                 response_cache=None, **gen_kwargs):
+        """
+        Args:
+            tokenizer: 分詞器
+            model: 模型
+            lang: 語言代碼，未指定 system_prompt 時決定系統提示
+            system_prompt: 自訂系統提示（可選）
+            max_context_tokens: 上下文預算（token 數）
+            stop_markers: 停止標記（預設 DEFAULT_STOP_MARKERS）
+            response_cache: ResponseCache（可選，以整段對話文字為鍵）
+            **gen_kwargs: generate 參數；未指定任何參數時使用 CHAT_GENERATION_KWARGS，
+                有指定時原樣使用（不混入聊天預設的 do_sample=False，與單輪測試的解碼方式一致）
+        """
+        self.tokenizer = tokenizer
+        self.model = model
+        self.lang = lang
+        self.system_prompt = system_prompt or _resolve_system_prompt(lang)
+        self.max_context_tokens = max_context_tokens
+        self.stop_markers = stop_markers
+        self.gen_kwargs = dict(gen_kwargs) if gen_kwargs else dict(CHAT_GENERATION_KWARGS)
+        self.stop_kwargs = build_stop_kwargs(tokenizer, stop_markers)
+        self.response_cache = response_cache
+        self._end_ids = self._encode("<|im_end|>\n")
+        self.reset()
+    
+    def _encode(self, text: str):
+        return self.tokenizer(
+            text, return_tensors="pt", add_special_tokens=False
+        ).input_ids.to(self.model.device)
+    
+    def reset(self):
+        """清空對話，只保留 system 前綴"""
+        self.history = []      # [(user_msg, reply), ...]
+        self._turn_ids = []    # 每回合完整 token（user + reply + <|im_end|>）
+        self._rebuild()
+    
+    def _rebuild(self):
+        """以快取的 system 前綴 KV 重建 session；保留回合的 token 於下一輪一次 prefill"""
+        prefix_ids, prefix_cache = get_prefix_kv_cache(
+            self.tokenizer, self.model, format_qwen_system_prefix(self.system_prompt)
+        )
+        self._ids = torch.cat([prefix_ids] + self._turn_ids, dim=-1)
+        self._cache = copy.deepcopy(prefix_cache)
+    
+    @property
+    def context_length(self) -> int:
+        """目前上下文的 token 數"""
+        return self._ids.shape[-1]
+    
+    def _fit_budget(self, needed: int):
+        """若加入 needed 個 token 會超出預算，從最舊的回合開始淘汰"""
+        length = self.context_length
+        evicted = False
+        while self._turn_ids and length + needed > self.max_context_tokens:
+            length -= self._turn_ids.pop(0).shape[-1]
+            self.history.pop(0)
+            evicted = True
+        if evicted:
+            # 位置編碼已寫入 KV，刪除前段後無法沿用，需從 system 前綴重建
+            self._rebuild()
+    
+    def _generate(self, user_msg: str, **extra_kwargs):
+        """生成一輪回覆但尚未寫入 session，回傳 (input_ids, turn_ids, outputs)"""
+        turn_ids = self._encode(format_qwen_user_turn(user_msg))
+        self._fit_budget(turn_ids.shape[-1] + self.gen_kwargs.get("max_new_tokens", 0))
+        
+        input_ids = torch.cat([self._ids, turn_ids], dim=-1)
+        try:
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    past_key_values=self._cache,
+                    **self.stop_kwargs,
+                    pad_token_id=_pad_token_id(self.tokenizer),
+                    **self.gen_kwargs,
+                    **extra_kwargs,
+                )
+        except Exception:
+            # cache 可能已被部分擴充，裁回上一輪結束的位置
+            self._cache.crop(self.context_length)
+            raise
+        return input_ids, turn_ids, outputs
+    
+    def _record_turn(self, user_msg: str, input_ids, turn_ids, outputs) -> str:
+        """將生成完成的回合寫入 session，回傳回覆文字"""
+        prompt_length = input_ids.shape[-1]
+        reply_ids = outputs[:, prompt_length:]
+        # 最後一個 token 沒有進入 cache；若是停止標記則捨棄，改接標準的 <|im_end|>\n
+        if reply_ids.shape[-1] and reply_ids[0, -1].item() in self.stop_kwargs["eos_token_id"]:
+            reply_ids = reply_ids[:, :-1]
+        reply = decode_new_tokens(self.tokenizer, outputs, prompt_length, self.stop_markers)[0]
+        
+        self._turn_ids.append(torch.cat([turn_ids, reply_ids, self._end_ids], dim=-1))
+        self._ids = torch.cat([input_ids, reply_ids, self._end_ids], dim=-1)
+        self.history.append((user_msg, reply))
+        return reply
+    
+    def _generate_turn(self, user_msg: str, **extra_kwargs) -> str:
+        return self._record_turn(user_msg, *self._generate(user_msg, **extra_kwargs))
+    
+    def _cache_lookup(self, user_msg: str):
+        """
+        以目前對話文字查詢回應快取
+        
+        Returns:
+            (快取鍵文字, 快取的回覆)；未啟用快取時為 (None, None)
+        """
+        if not _use_response_cache(self.response_cache, self.model, self.gen_kwargs):
+            return None, None
+        text = format_qwen_system_prefix(self.system_prompt) + "".join(
+            format_qwen_user_turn(u) + r + "<|im_end|>\n" for u, r in self.history
+        ) + format_qwen_user_turn(user_msg)
+        return text, self.response_cache.get(text, self._cache_params())
+    
+    def _cache_params(self) -> dict:
+        # 上下文預算會影響淘汰後實際送入模型的內容，一併納入鍵
+        return {**_cache_params(self.stop_markers, self.gen_kwargs),
+                "max_context_tokens": self.max_context_tokens}
+    
+    def append_turn(self, user_msg: str, reply: str):
+        """
+        加入一輪既有的對話（不生成），其 token 會在下一輪生成時一併 prefill
+        
+        Args:
+            user_msg: 用戶訊息
+            reply: 既有的 AI 回覆
+        """
+        turn_ids = torch.cat(
+            [self._encode(format_qwen_user_turn(user_msg) + reply), self._end_ids], dim=-1
+        )
+        self._fit_budget(turn_ids.shape[-1])
+        self._turn_ids.append(turn_ids)
+        self._ids = torch.cat([self._ids, turn_ids], dim=-1)
+        self.history.append((user_msg, reply))
+    
+    def ask(self, user_msg: str) -> str:
+        """
+        送出一輪訊息並取得回覆
+        
+        Args:
+            user_msg: 用戶訊息
+        
+        Returns:
+            AI 回覆
+        """
+        if not user_msg or not user_msg.strip():
+            return "❌ 請輸入消息。"
+        try:
+            cache_text, reply = self._cache_lookup(user_msg)
+            if reply is not None:
+                self.append_turn(user_msg, reply)
+            else:
+                reply = self._generate_turn(user_msg)
+                if cache_text is not None:
+                    self.response_cache.put(cache_text, self._cache_params(), reply)
+        except Exception as e:
+            return f"❌ 推理失敗：{str(e)}"
+        return reply if reply else "（無有效回應）"
+    
+    def ask_stream(self, user_msg: str):
+        """
+        串流版 ask：逐段 yield 解碼後的文字，結束後回合寫入 session
+        
+        消費端中途離開（關閉 generator，如 UI 重新執行）時，被中止的半段回覆不會寫入
+        session，cache 也裁回上一輪結束的位置。
+        
+        Args:
+            user_msg: 用戶訊息
+        
+        Yields:
+            增量文字片段
+        """
+        if not user_msg or not user_msg.strip():
+            yield "❌ 請輸入消息。"
+            return
+        
+        cache_text, cached = self._cache_lookup(user_msg)
+        if cached is not None:
+            self.append_turn(user_msg, cached)
+            yield cached if cached else "（無有效回應）"
+            return
+        
+        results = []
+        
+        def _run(**stream_kwargs):
+            results.append(self._generate(user_msg, **stream_kwargs))
+        
+        finished = False
+        try:
+            yield from _stream_in_background(self.tokenizer, _run)
+            finished = True
+        finally:
+            # 背景 generate 此時已結束；中途離開時捨棄 cache 中被中止的回合
+            if not finished and results:
+                self._cache.crop(self.context_length)
+        if not results:
+            return
+        reply = self._record_turn(user_msg, *results[0])
+        # 只快取完整讀完的回覆
+        if cache_text is not None:
+            self.response_cache.put(cache_text, self._cache_params(), reply)
+
+
+def run_cli_interactive(base_model_path: str, lora_path: str = None, lang: str = "zh-TW",
+                        max_context_tokens: int = DEFAULT_CONTEXT_BUDGET, use_cache: bool = True):
+    """
+    運行交互式命令行聊天（多輪對話）
     
     Args:
         base_model_path: 基礎模型路徑
         lora_path: LoRA 適配器路徑（可選）
         lang: 語言代碼
+        max_context_tokens: 多輪對話的上下文預算
+        use_cache: 是否使用回應快取
     """
     tokenizer, model = load_chat_model(base_model_path, lora_path)
     
@@ -184,10 +945,18 @@ def run_cli_interactive(base_model_path: str, lora_path: str = None, lang: str =
         print("❌ 無法載入模型，退出")
         return
     
+    response_cache = None
+    if use_cache:
+        print("📦 計算模型指紋（回應快取）...")
+        response_cache = ResponseCache.for_model(base_model_path, lora_path)
+    
     print("\n" + "=" * 50)
     print(f"  聊天模式 - 語言: {lang}")
     print("=" * 50)
-    print("輸入 'exit' 或 'quit' 離開\n")
+    print("輸入 'exit' 或 'quit' 離開，輸入 'reset' 清空對話\n")
+    
+    session = ChatSession(tokenizer, model, lang, max_context_tokens=max_context_tokens,
+                          response_cache=response_cache)
     
     while True:
         msg = input("你：").strip()
@@ -195,11 +964,18 @@ def run_cli_interactive(base_model_path: str, lora_path: str = None, lang: str =
             print("再見！")
             break
         
+        if msg == "reset":
+            session.reset()
+            print("（對話已清空）\n")
+            continue
+        
         if not msg:
             continue
         
-        reply = chat_ask(tokenizer, model, msg, lang)
-        print(f"AI：{reply}\n")
+        print("AI：", end="", flush=True)
+        for chunk in session.ask_stream(msg):
+            print(chunk, end="", flush=True)
+        print("\n")
 
 
 # ========== CLI 入口 ==========
@@ -224,6 +1000,17 @@ if __name__ == "__main__":
         default="zh-TW",
         help="語言代碼（預設: zh-TW）"
     )
+    parser.add_argument(
+        "--max_context_tokens",
+        type=int,
+        default=DEFAULT_CONTEXT_BUDGET,
+        help=f"多輪對話上下文預算，超出時淘汰最舊的回合（預設: {DEFAULT_CONTEXT_BUDGET}）"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="停用回應快取（預設啟用，只對 greedy 生成有效）"
+    )
     
     args = parser.parse_args()
     
@@ -242,4 +1029,10 @@ if __name__ == "__main__":
             sys.exit(1)
     
     # 運行交互式聊天
-    run_cli_interactive(str(model_path), str(lora_path) if lora_path else None, args.lang)
+    run_cli_interactive(
+        str(model_path),
+        str(lora_path) if lora_path else None,
+        args.lang,
+        max_context_tokens=args.max_context_tokens,
+        use_cache=not args.no_cache,
+    )
@@ -0,0 +1,427 @@
+"""
+評測執行共用工具 - 供 test_behavior.py / test_base_model.py 使用
+
+負責測試結果 journal（每題完成立即追加寫入 JSONL，中斷後可用 --resume 續跑）、
+--workers 多程序分片執行，以及由 journal 組裝 Summary JSON 與 For_Text 完整回覆檔
+（輸出後一併匯入測試結果資料庫，見 results_store.py）。
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from results_store import ResultsStore
+
+
+def make_qid(idx: int) -> str:
+    """題號格式：Q001, Q002, ... Q200"""
+    return f"Q{idx:03d}"
+
+
+def format_test_block(q_id: str, test: dict) -> str:
+    """測試標題與輸入區塊（終端與 full 檔案共用）"""
+    return (
+        f"▶ [{q_id}] 測試項目：{test['name']}\n"
+        f"  使用輸入：{test['input']}\n\n"
+    )
+
+
+def build_result_entry(q_id: str, test: dict, response: str, max_summary_chars: int = None):
+    """
+    建立單題的 summary 物件與 full 區塊
+
+    Args:
+        q_id: 題號
+        test: 測試用例（name / input）
+        response: 模型完整回覆
+        max_summary_chars: assistant_summary 最大長度（None 表示不截斷）
+
+    Returns:
+        (summary_item, full_block)
+    """
+    # 清理回覆（單行化以便 summary 檔閱讀，且只保留 AI 回答內容）
+    response_single = response.replace('\r', ' ').replace('\n', ' ').strip()
+
+    # 建 summary（超過上限時截斷並標示）
+    if max_summary_chars is not None and len(response_single) > max_summary_chars:
+        summary = response_single[:max_summary_chars].rstrip() + " ... [TRUNCATED]"
+        truncated_flag = True
+    else:
+        summary = response_single
+        truncated_flag = False
+
+    summary_item = {
+        "qid": q_id,
+        "name": test["name"],
+        "input": test["input"],
+        "assistant_summary": summary
+    }
+
+    # full 檔案保持原樣
+    full_block = (
+        "assistant (full):\n"
+        + response + "\n"
+        + ("[TRUNCATED IN SUMMARY]\n" if truncated_flag else "")
+        + "\n" + "-" * 60 + "\n\n"
+    )
+    return summary_item, full_block
+
+
+# ------------------------------
+# 測試結果 journal（JSONL，每題一行）
+# ------------------------------
+# chat.py 推理發生例外時回傳的訊息開頭；這類回覆不寫入 journal，--resume 時會重新生成
+FAILED_RESPONSE_PREFIX = "❌ 推理失敗"
+
+
+def journal_path_for(output_dir, model_name: str) -> Path:
+    """journal 檔案路徑，與 Summary JSON 放在同一目錄"""
+    return Path(output_dir) / f"AI-Behavior-Research_{model_name}_journal.jsonl"
+
+
+def load_journal(journal_path) -> dict:
+    """
+    讀取 journal，回傳 {qid: record}
+
+    中斷時最後一行可能只寫了一半，解析失敗的行會被略過（該題視為未完成）。
+    """
+    records = {}
+    journal_path = Path(journal_path)
+    if not journal_path.exists():
+        return records
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and "qid" in record and "response" in record:
+                records[record["qid"]] = record
+    return records
+
+
+def load_completed(journal_path, tests: list) -> dict:
+    """
+    讀取 journal 中已完成、且與目前測試集相符（輸入相同）的題目
+
+    Returns:
+        {qid: record}
+    """
+    records = load_journal(journal_path)
+    completed = {}
+    for idx, t in enumerate(tests, 1):
+        q_id = make_qid(idx)
+        record = records.get(q_id)
+        if record and record.get("input") == t["input"]:
+            completed[q_id] = record
+    return completed
+
+
+def _truncate_partial_line(journal_path):
+    """截掉中斷時只寫了一半的最後一行，避免續跑追加的紀錄接在殘行後面而一起失效"""
+    journal_path = Path(journal_path)
+    if not journal_path.exists():
+        return
+    with open(journal_path, "rb+") as f:
+        end = f.read().rfind(b"\n") + 1
+        if end < f.tell():
+            f.truncate(end)
+
+
+def open_journal(journal_path, resume: bool = False):
+    """開啟 journal；續跑時追加（先截掉不完整的最後一行），否則清空重寫"""
+    if resume:
+        _truncate_partial_line(journal_path)
+    return open(journal_path, "a" if resume else "w", encoding="utf-8")
+
+
+def append_journal(f_journal, q_id: str, test: dict, response: str) -> bool:
+    """
+    追加一題結果並立即 flush，確保中斷時已完成的題目不會遺失
+
+    推理失敗的回覆不寫入（該題視為未完成，--resume 時會重試）。
+
+    Returns:
+        是否已寫入
+    """
+    if response.startswith(FAILED_RESPONSE_PREFIX):
+        print(f"[WARN] {q_id} 推理失敗，未寫入 journal（--resume 時會重新生成）")
+        return False
+    record = {
+        "qid": q_id,
+        "name": test["name"],
+        "input": test["input"],
+        "response": response
+    }
+    f_journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+    f_journal.flush()
+    return True
+
+
+def write_outputs(tests: list, records: dict, output_path, output_full_path, header: str,
+                  max_summary_chars: int = None) -> int:
+    """
+    依測試集順序，由 journal 紀錄輸出 Summary JSON 與 For_Text 檔
+
+    Args:
+        tests: 測試用例列表
+        records: {qid: record}
+        output_path: Summary JSON 路徑
+        output_full_path: For_Text 路徑
+        header: For_Text 標頭
+        max_summary_chars: assistant_summary 最大長度（None 表示不截斷）
+
+    Returns:
+        寫入的題數
+    """
+    summary_json = []
+    with open(output_full_path, "w", encoding="utf-8") as f_full:
+        # 寫入標頭到 full 檔案
+        f_full.write(header)
+        for idx, t in enumerate(tests, 1):
+            q_id = make_qid(idx)
+            record = records.get(q_id)
+            if record is None:
+                continue
+            summary_item, full_block = build_result_entry(q_id, t, record["response"], max_summary_chars)
+            summary_json.append(summary_item)
+            f_full.write(format_test_block(q_id, t))
+            f_full.write(full_block)
+
+    # 輸出 summary 為 JSON 格式
+    with open(output_path, "w", encoding="utf-8") as f_summary:
+        json.dump(summary_json, f_summary, ensure_ascii=False, indent=2)
+
+    # 匯入測試結果資料庫（失敗不影響輸出檔）
+    try:
+        store = ResultsStore()
+        try:
+            store.ingest_file(output_path)
+            store.ingest_file(output_full_path)
+        finally:
+            store.close()
+    except Exception as e:
+        print(f"[WARN] 無法匯入測試結果資料庫：{e}")
+
+    return len(summary_json)
+
+
+# ------------------------------
+# 多程序分片執行（--workers N）
+# ------------------------------
+def parse_shard(spec: str):
+    """解析 "i/N"（i 由 1 起算），回傳 (shard_id, num_shards)，shard_id 由 0 起算"""
+    index, num_shards = (int(x) for x in spec.split("/"))
+    if not 1 <= index <= num_shards:
+        raise ValueError(f"無效的分片：{spec}")
+    return index - 1, num_shards
+
+
+def shard_tests(indexed_tests: list, shard_id: int, num_shards: int) -> list:
+    """輪流分配題目（idx 由 1 起算），讓長短題目平均分散到各分片"""
+    return [(idx, t) for idx, t in indexed_tests if (idx - 1) % num_shards == shard_id]
+
+
+def shard_journal_path(journal_path, shard_id: int, num_shards: int) -> Path:
+    """分片 journal 路徑，與主 journal 放在同一目錄"""
+    journal_path = Path(journal_path)
+    return journal_path.with_name(f"{journal_path.stem}.shard{shard_id + 1}of{num_shards}.jsonl")
+
+
+def _shard_journals(journal_path) -> list:
+    journal_path = Path(journal_path)
+    return sorted(journal_path.parent.glob(f"{journal_path.stem}.shard*.jsonl"))
+
+
+def clear_shard_journals(journal_path):
+    """刪除先前執行遺留的分片 journal"""
+    for path in _shard_journals(journal_path):
+        path.unlink()
+
+
+def merge_shard_journals(journal_path, tests: list, resume: bool = False) -> int:
+    """
+    將各分片 journal 併入主 journal（依題號排序）並刪除分片檔
+
+    Args:
+        journal_path: 主 journal 路徑
+        tests: 測試用例列表
+        resume: 是否保留主 journal 中既有的紀錄
+
+    Returns:
+        合併後的完成題數
+    """
+    records = load_completed(journal_path, tests) if resume else {}
+    shard_paths = _shard_journals(journal_path)
+    for path in shard_paths:
+        records.update(load_completed(path, tests))
+
+    with open(journal_path, "w", encoding="utf-8") as f_journal:
+        for q_id in sorted(records):
+            f_journal.write(json.dumps(records[q_id], ensure_ascii=False) + "\n")
+
+    for path in shard_paths:
+        path.unlink()
+    return len(records)
+
+
+def pin_worker_threads(shard_id: int, num_shards: int) -> int:
+    """
+    分片程序綁定一段連續的 CPU 核心（支援 sched_setaffinity 的平台），回傳可用執行緒數
+
+    連續核心通常位於同一個 CPU socket，可避免跨 socket 存取記憶體。
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    per_worker = max(1, len(cores) // num_shards)
+    start = (shard_id * per_worker) % len(cores)
+    assigned = cores[start:start + per_worker]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, assigned)
+    return len(assigned)
+
+
+def _worker_env(worker_id: int, num_workers: int, gpu_count: int) -> dict:
+    """分片程序的環境變數：限制 BLAS/OpenMP 執行緒數，有多張 GPU 時輪流指定裝置"""
+    env = os.environ.copy()
+    threads = str(max(1, (os.cpu_count() or 1) // num_workers))
+    env["OMP_NUM_THREADS"] = threads
+    env["MKL_NUM_THREADS"] = threads
+    if gpu_count > 0:
+        visible = env.get("CUDA_VISIBLE_DEVICES")
+        devices = visible.split(",") if visible else [str(i) for i in range(gpu_count)]
+        env["CUDA_VISIBLE_DEVICES"] = devices[worker_id % len(devices)]
+    return env
+
+
+def run_shard_workers(script_path, argv: list, num_workers: int, gpu_count: int = 0) -> list:
+    """
+    以子程序執行各分片（每個程序各自載入模型），等待全部結束
+
+    Args:
+        script_path: 測試腳本路徑
+        argv: 原始命令列參數（會附加 --workers 1 --shard i/N --no-clean）
+        num_workers: 程序數
+        gpu_count: 可用 GPU 數（0 表示只用 CPU）
+
+    Returns:
+        各程序的結束代碼
+    """
+    procs = []
+    for worker_id in range(num_workers):
+        cmd = [sys.executable, str(script_path), *argv,
+               "--workers", "1", "--shard", f"{worker_id + 1}/{num_workers}", "--no-clean"]
+        procs.append(subprocess.Popen(cmd, env=_worker_env(worker_id, num_workers, gpu_count)))
+    return [proc.wait() for proc in procs]
+
+
+# ------------------------------
+# 完整測試流程（生成 → journal → 輸出檔）
+# ------------------------------
+def generate_responses(indexed_tests: list, ask, ask_batch, batch_size: int = 1):
+    """依 batch_size 分組生成，仍依原始順序逐題 yield (idx, test, response)
+
+    Args:
+        indexed_tests: [(idx, test), ...]，idx 為測試集中的原始題號
+        ask: 單題生成函式 (user_msg) -> response
+        ask_batch: 多題生成函式 (user_msgs) -> [response, ...]
+        batch_size: 每批題數
+    """
+    batch_size = max(1, batch_size)
+    for start in range(0, len(indexed_tests), batch_size):
+        chunk = indexed_tests[start:start + batch_size]
+        if len(chunk) == 1:
+            responses = [ask(chunk[0][1]["input"])]
+        else:
+            responses = ask_batch([t["input"] for _, t in chunk])
+        for (idx, t), response in zip(chunk, responses):
+            yield idx, t, response
+
+
+def run_test_suite(tests: list, journal_path, output_path, output_full_path, header: str,
+                   ask, ask_batch, batch_size: int = 1, multi_turn=None, resume: bool = False,
+                   num_workers: int = 1, shard=None, script_path=None, argv: list = None,
+                   gpu_count: int = 0, max_summary_chars: int = None):
+    """
+    執行整份測試集：依 journal 續跑、--workers 分片或單一程序生成，最後由 journal 輸出結果
+
+    Args:
+        tests: 測試用例列表
+        journal_path: 主 journal 路徑
+        output_path / output_full_path: Summary JSON / For_Text 路徑
+        header: For_Text 標頭
+        ask / ask_batch: 單題 / 多題生成函式
+        batch_size: 每批題數
+        multi_turn: 多輪模式的生成函式 (tests, completed) -> 逐題 yield (idx, test, response)；
+            None 表示單輪
+        resume: 是否從 journal 續跑
+        num_workers: 大於 1 時以子程序分片執行（以 script_path 與 argv 重新啟動測試腳本）
+        shard: 本程序為分片子程序時的 (shard_id, num_shards)
+        gpu_count: 可用 GPU 數（分片子程序依此分配 GPU）
+        max_summary_chars: assistant_summary 最大長度
+
+    Returns:
+        寫入的題數；分片子程序只負責生成，回傳 None
+    """
+    if num_workers > 1:
+        # 多程序分片：各子程序寫入自己的分片 journal，全部結束後依題號併回主 journal
+        if resume:
+            merge_shard_journals(journal_path, tests, resume=True)
+        else:
+            clear_shard_journals(journal_path)
+            open_journal(journal_path, resume=False).close()
+        print(f"[多程序] 啟動 {num_workers} 個分片程序\n")
+        exit_codes = run_shard_workers(script_path, argv, num_workers, gpu_count)
+        done = merge_shard_journals(journal_path, tests, resume=True)
+        print(f"[多程序] 分片合併完成，已完成 {done} / {len(tests)} 題\n")
+        if any(exit_codes):
+            print(f"[ERROR] 部分分片程序失敗（結束代碼：{exit_codes}），可使用 --resume 重跑未完成的題目")
+    else:
+        completed = load_completed(journal_path, tests) if resume else {}
+        if shard is not None:
+            # 分片程序：主 journal 已含先前完成的題目，本分片的進度寫入分片 journal
+            worker_journal_path = shard_journal_path(journal_path, *shard)
+            if resume:
+                completed.update(load_completed(worker_journal_path, tests))
+        else:
+            worker_journal_path = journal_path
+        if resume:
+            print(f"[續跑] journal：{journal_path}，已完成 {len(completed)} / {len(tests)} 題\n")
+
+        with open_journal(worker_journal_path, resume=resume) as f_journal:
+            if multi_turn is not None:
+                print("[多輪] 多輪對話模式：所有測試題在同一段對話中依序提問\n")
+                responses = multi_turn(tests, completed)
+            else:
+                if batch_size > 1:
+                    print(f"[批次] 批次生成模式：每批 {batch_size} 題\n")
+                pending = [(idx, t) for idx, t in enumerate(tests, 1) if make_qid(idx) not in completed]
+                if shard is not None:
+                    pending = shard_tests(pending, *shard)
+                responses = generate_responses(pending, ask, ask_batch, batch_size)
+
+            for idx, t, response in responses:
+                q_id = make_qid(idx)  # Q001, Q002, ... Q200
+                # 測試標題與輸入
+                print(format_test_block(q_id, t))
+
+                append_journal(f_journal, q_id, t, response)
+
+                # 於終端印出完整回覆（保持原來的 format），檔案層級則維持 summary / full 分離
+                _, full_block = build_result_entry(q_id, t, response, max_summary_chars)
+                print(full_block)
+
+        if shard is not None:
+            # 分片程序只負責生成，輸出檔由主程序合併後產生
+            return None
+
+    # 由 journal 依題號順序重建 summary / full 輸出檔
+    return write_outputs(
+        tests, load_completed(journal_path, tests), output_path, output_full_path, header, max_summary_chars
+    )
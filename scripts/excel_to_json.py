@@ -2,7 +2,13 @@ import sys
 import os
 import json
 import argparse
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+from check_model_hash import calc_sha256
+from results_store import ResultsStore
 
 
 # 多語系欄位配置
@@ -25,6 +31,12 @@ LANGUAGE_FIELDS = {
 }
 
 
+# 目錄模式要轉換的分析工作簿（檔名關鍵字）
+ANALYSIS_WORKBOOK_KEYWORDS = ("分析統計表", "分析统计表", "AnalysisStatistics")
+# 目錄模式記錄上次轉換狀態的檔案（放在掃描根目錄）
+MANIFEST_NAME = ".excel_to_json_manifest.json"
+
+
 def detect_language_from_columns(columns):
     """根據 DataFrame 欄位名稱偵測語系"""
     for lang, config in LANGUAGE_FIELDS.items():
@@ -33,38 +45,80 @@ def detect_language_from_columns(columns):
     return "zh-TW"  # 預設繁體中文
 
 
-def convert_excel_to_json(excel_path: str) -> None:
-    """將 Excel (.xlsx) 轉成 JSON，統計列轉成獨立的 "統計" 鍵"""
+def _column_names(header_row) -> list:
+    """第一列轉成欄位名稱（空白欄命名為 Unnamed: i、重複欄加 .1 .2 後綴，與 pandas 相同）"""
+    columns, seen = [], {}
+    for i, name in enumerate(header_row):
+        if name is None:
+            name = f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def read_sheets(excel_path: str) -> dict:
+    """以 read-only 模式串流讀取所有 sheet，回傳 {sheet 名稱: [每列的 dict]}"""
+    wb = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        sheets = {}
+        for ws in wb.worksheets:
+            # 部分工具產生的檔案記錄的範圍不正確，改為讀到實際最後一列
+            ws.reset_dimensions()
+            rows = ws.iter_rows(values_only=True)
+            header_row = next(rows, None)
+            if header_row is None:
+                sheets[ws.title] = ([], [])
+                continue
+            columns = _column_names(header_row)
+            records = []
+            for row in rows:
+                # 全空白的列略過（pandas 同樣不保留檔尾空白列）
+                if all(val is None for val in row):
+                    continue
+                row = tuple(row[:len(columns)]) + (None,) * (len(columns) - len(row))
+                records.append(dict(zip(columns, row)))
+            sheets[ws.title] = (columns, records)
+        return sheets
+    finally:
+        wb.close()
+
+
+def convert_excel_to_json(excel_path: str, verbose: bool = True):
+    """
+    將 Excel (.xlsx) 轉成 JSON，統計列轉成獨立的 "統計" 鍵
+
+    Returns:
+        輸出的 JSON 路徑，失敗時回傳 None
+    """
+    log = print if verbose else (lambda *a, **k: None)
 
     # 標準化路徑
     excel_path = os.path.abspath(excel_path)
 
     if not os.path.isfile(excel_path):
         print(f"找不到 Excel 檔案: {excel_path}")
-        return
+        return None
 
     if not excel_path.lower().endswith(".xlsx"):
         print("請提供 .xlsx 檔案")
-        return
+        return None
 
     # 讀取全部 sheet
-    excel_data = pd.read_excel(excel_path, sheet_name=None)
+    excel_data = read_sheets(excel_path)
 
     json_output = {}
-    for sheet_name, df in excel_data.items():
-        # NaN → None，使 JSON 合法
-        df = df.where(pd.notnull(df), None)
-        
+    for sheet_name, (columns, records) in excel_data.items():
         # 偵測語系
-        lang = detect_language_from_columns(df.columns)
+        lang = detect_language_from_columns(columns)
         config = LANGUAGE_FIELDS[lang]
         qid_field = config["qid_field"]
         stat_keywords = config["stat_keywords"]
         exclude_fields = config["exclude_fields"]
-        print(f"Sheet '{sheet_name}' 偵測到語系: {lang}")
-        
-        # 轉成 dict list
-        records = df.to_dict(orient="records")
+        log(f"Sheet '{sheet_name}' 偵測到語系: {lang}")
         
         # 分離資料列和統計列
         data_records = []
@@ -114,21 +168,146 @@ def convert_excel_to_json(excel_path: str) -> None:
     json_path = excel_path.replace(".xlsx", ".json")
 
     with open(json_path, "w", encoding="utf-8") as jf:
-        json.dump(json_output, jf, ensure_ascii=False, indent=2)
+        # 日期等非 JSON 型別轉成字串
+        json.dump(json_output, jf, ensure_ascii=False, indent=2, default=str)
 
-    print(f"完成轉換：{excel_path} → {json_path}")
+    log(f"完成轉換：{excel_path} → {json_path}")
     for sheet_name, content in json_output.items():
         data_count = len(content.get("資料", []))
         has_stats = "統計" in content
-        print(f"  Sheet '{sheet_name}': {data_count} 筆資料" + (", 包含統計" if has_stats else ""))
+        log(f"  Sheet '{sheet_name}': {data_count} 筆資料" + (", 包含統計" if has_stats else ""))
+    return json_path
+
+
+def find_analysis_workbooks(root_dir) -> list:
+    """遞迴尋找 root_dir 下的分析統計表（略過 _output.xlsx 與 Excel 暫存檔）"""
+    workbooks = []
+    for path in sorted(Path(root_dir).rglob("*.xlsx")):
+        name = path.name
+        if name.startswith("~$") or name.endswith("_output.xlsx"):
+            continue
+        if any(keyword in name for keyword in ANALYSIS_WORKBOOK_KEYWORDS):
+            workbooks.append(path)
+    return workbooks
+
+
+def _load_manifest(manifest_path: Path) -> dict:
+    if not manifest_path.exists():
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _is_up_to_date(path: Path, entry: dict, stat) -> bool:
+    """JSON 仍存在且 (大小, 修改時間) 未變，或內容雜湊未變時視為不需重新轉換"""
+    if not entry or not path.with_suffix(".json").exists():
+        return False
+    if entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+        return True
+    return entry.get("sha256") == calc_sha256(str(path))
+
+
+def _convert_worker(excel_path: str):
+    """回傳 (excel_path, json_path, 錯誤訊息)；損壞或鎖定中的檔案只記錄錯誤，不中斷其他轉換"""
+    try:
+        return excel_path, convert_excel_to_json(excel_path, verbose=False), None
+    except Exception as e:
+        return excel_path, None, f"{type(e).__name__}: {e}"
+
+
+def convert_directory(root_dir: str, workers: int = None, force: bool = False,
+                      store: ResultsStore = None) -> None:
+    """
+    轉換 root_dir（如 test_logs/）下所有分析統計表，多個檔案以多程序平行處理
+
+    與上次轉換時大小、修改時間或內容雜湊相同的檔案會略過（記錄於 root_dir 下的 manifest）。
+
+    Args:
+        root_dir: 掃描的根目錄
+        workers: 程序數（None 依 CPU 數決定）
+        force: 忽略 manifest，全部重新轉換
+        store: 測試結果資料庫（可選），轉換完成的 JSON 一併匯入
+    """
+    root = Path(root_dir).resolve()
+    if not root.is_dir():
+        print(f"找不到目錄: {root}")
+        return
+
+    workbooks = find_analysis_workbooks(root)
+    if not workbooks:
+        print(f"{root} 下找不到分析統計表")
+        return
+
+    manifest_path = root / MANIFEST_NAME
+    manifest = {} if force else _load_manifest(manifest_path)
+    new_manifest, pending = {}, []
+    for path in workbooks:
+        rel = path.relative_to(root).as_posix()
+        stat = path.stat()
+        entry = manifest.get(rel)
+        if _is_up_to_date(path, entry, stat):
+            # 只有修改時間變動時一併更新記錄，下次不必再算雜湊
+            new_manifest[rel] = {**entry, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        else:
+            pending.append(path)
+
+    print(f"找到 {len(workbooks)} 個分析統計表，需要轉換 {len(pending)} 個，略過 {len(workbooks) - len(pending)} 個未變更的檔案")
+
+    if len(pending) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(pending))) as pool:
+            results = list(pool.map(_convert_worker, map(str, pending)))
+    else:
+        results = [_convert_worker(str(path)) for path in pending]
+
+    failed = 0
+    for excel_path, json_path, error in results:
+        path = Path(excel_path)
+        if json_path is None:
+            failed += 1
+            print(f"轉換失敗：{path.relative_to(root)}" + (f"（{error}）" if error else ""))
+            continue
+        stat = path.stat()
+        new_manifest[path.relative_to(root).as_posix()] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": calc_sha256(excel_path),
+        }
+        print(f"完成轉換：{path.relative_to(root)} → {Path(json_path).name}")
+        if store is not None:
+            store.ingest_file(json_path)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(new_manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(f"完成：轉換 {len(results) - failed} 個檔案" + (f"，失敗 {failed} 個" if failed else ""))
 
 
 def main():
     parser = argparse.ArgumentParser(description="將 Excel 轉換為 JSON")
-    parser.add_argument("--excel", required=True, help="Excel 檔案路徑 (.xlsx)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--excel", help="Excel 檔案路徑 (.xlsx)")
+    source.add_argument("--dir", help="目錄模式：轉換此目錄（如 test_logs）下所有分析統計表")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="目錄模式的平行程序數（預設依 CPU 數決定）")
+    parser.add_argument("--force", action="store_true",
+                        help="目錄模式忽略上次的轉換記錄，全部重新轉換")
+    parser.add_argument("--no-store", action="store_true",
+                        help="不將轉換結果匯入測試結果資料庫（cache/results.sqlite）")
 
     args = parser.parse_args()
-    convert_excel_to_json(args.excel)
+    store = None if args.no_store else ResultsStore()
+    try:
+        if args.dir:
+            convert_directory(args.dir, workers=args.workers, force=args.force, store=store)
+        else:
+            json_path = convert_excel_to_json(args.excel)
+            if json_path and store is not None:
+                store.ingest_file(json_path)
+    finally:
+        if store is not None:
+            store.close()
 
 
 if __name__ == "__main__":
@@ -15,10 +15,25 @@ if str(_script_dir) not in sys.path:
 # 直接從 chat 模組導入公共接口
 from chat import (
     load_chat_model, 
+    AdapterPool,
+    DEFAULT_MAX_ADAPTERS,
     chat_ask, 
+    chat_ask_stream,
+    ChatSession,
+    DEFAULT_CONTEXT_BUDGET,
     format_qwen_single_turn, 
+    format_qwen_system_prefix,
+    format_qwen_user_turn,
+    generate_with_prefix_cache,
+    generate_reply,
+    generate_reply_batch,
+    build_stop_kwargs,
+    decode_new_tokens,
+    DEFAULT_STOP_MARKERS,
+    clear_prefix_kv_cache,
     SYSTEM_PROMPTS,
 )
+from response_cache import ResponseCache
 
 # 取得專案根目錄
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
@@ -26,8 +41,23 @@ PROJECT_ROOT = Path(__file__).resolve().parent.parent
 # 保留原有的導出接口，以便向後相容
 __all__ = [
     "load_chat_model", 
+    "AdapterPool",
+    "DEFAULT_MAX_ADAPTERS",
     "chat_ask", 
+    "chat_ask_stream",
+    "ChatSession",
+    "DEFAULT_CONTEXT_BUDGET",
     "format_qwen_single_turn", 
+    "format_qwen_system_prefix",
+    "format_qwen_user_turn",
+    "generate_with_prefix_cache",
+    "generate_reply",
+    "generate_reply_batch",
+    "build_stop_kwargs",
+    "decode_new_tokens",
+    "DEFAULT_STOP_MARKERS",
+    "clear_prefix_kv_cache",
     "SYSTEM_PROMPTS",
+    "ResponseCache",
     "PROJECT_ROOT"
 ]
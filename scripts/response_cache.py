@@ -0,0 +1,213 @@
+"""
+回應快取 - 以「模型指紋 + prompt + 生成參數」為鍵的磁碟快取（SQLite）
+
+供 test_behavior.py / test_base_model.py / chat.py 共用。
+只有確定性的生成（greedy，do_sample=False）才會寫入或讀取快取，
+因此 base 模型與 LoRA 未變動時，重跑同一份測試集幾乎不需要重新推理。
+
+模型指紋由權重檔與設定檔的 SHA256 組成；每個檔案的雜湊會依
+(路徑, 大小, 修改時間) 記錄在同一個資料庫中，只有第一次需要完整讀檔。
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from check_model_hash import calc_sha256
+
+# 動態獲取專案根目錄
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+DEFAULT_CACHE_PATH = PROJECT_ROOT / "cache" / "response_cache.sqlite"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024   # 回應內容總大小上限
+DEFAULT_MAX_ENTRIES = 100_000           # 筆數上限
+
+# base 模型目錄中納入指紋的檔案類型（權重、設定、tokenizer）
+_MODEL_FILE_SUFFIXES = {".safetensors", ".bin", ".json", ".model"}
+
+
+def _fingerprint_files(model_dir: Path) -> list:
+    """取得納入指紋的檔案；LoRA 目錄只取 adapter_* 檔案"""
+    if (model_dir / "adapter_config.json").exists():
+        files = [p for p in model_dir.iterdir() if p.is_file() and p.name.startswith("adapter_")]
+    else:
+        files = [p for p in model_dir.iterdir() if p.is_file() and p.suffix in _MODEL_FILE_SUFFIXES]
+    return sorted(files)
+
+
+def is_deterministic(model, gen_kwargs: dict) -> bool:
+    """生成是否為確定性（未開啟取樣）；未指定 do_sample 時以模型的 generation_config 為準"""
+    if "do_sample" in gen_kwargs:
+        return not gen_kwargs["do_sample"]
+    generation_config = getattr(model, "generation_config", None)
+    return not getattr(generation_config, "do_sample", False)
+
+
+class ResponseCache:
+    """
+    綁定單一模型指紋的回應快取
+
+    多個實例（不同模型、不同程序）可共用同一個資料庫檔案。
+    超過筆數或大小上限時，依最後存取時間淘汰最久未使用的紀錄（LRU）。
+    """
+
+    def __init__(self, fingerprint: str, cache_path=DEFAULT_CACHE_PATH,
+                 max_bytes: int = DEFAULT_MAX_BYTES, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            fingerprint: 模型指紋（見 model_fingerprint）
+            cache_path: SQLite 檔案路徑
+            max_bytes: 回應內容總大小上限
+            max_entries: 筆數上限
+        """
+        self.fingerprint = fingerprint
+        self.cache_path = Path(cache_path)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn = _connect(self.cache_path)
+
+    @classmethod
+    def for_model(cls, base_model_path: str, adapter_path: str = None,
+                  cache_path=DEFAULT_CACHE_PATH, **kwargs) -> "ResponseCache":
+        """依 base 模型與（可選）LoRA 路徑計算指紋並建立快取"""
+        fingerprint = model_fingerprint(base_model_path, adapter_path, cache_path)
+        return cls(fingerprint, cache_path, **kwargs)
+
+    def is_cacheable(self, model, gen_kwargs: dict) -> bool:
+        """只有確定性的生成才使用快取"""
+        return is_deterministic(model, gen_kwargs)
+
+    def make_key(self, prompt: str, gen_params: dict) -> str:
+        """快取鍵：模型指紋 + 完整 prompt + 生成參數"""
+        payload = json.dumps(
+            {"model": self.fingerprint, "prompt": prompt, "params": gen_params},
+            ensure_ascii=False, sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, prompt: str, gen_params: dict):
+        """查詢快取，命中時更新存取時間並回傳回應，否則回傳 None"""
+        key = self.make_key(prompt, gen_params)
+        row = self._conn.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        with self._conn:
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+        self.hits += 1
+        return row[0]
+
+    def put(self, prompt: str, gen_params: dict, response: str):
+        """寫入一筆回應，必要時淘汰最久未使用的紀錄"""
+        key = self.make_key(prompt, gen_params)
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # 由最舊的存取時間開始刪除，直到回到上限內
+        rows = self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall()
+        doomed = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def stats(self) -> str:
+        """本次執行的命中統計"""
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return f"命中 {self.hits} / {total}（{rate:.1f}%）"
+
+    def close(self):
+        self._conn.close()
+
+
+def _connect(cache_path: Path) -> sqlite3.Connection:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # 多個評測程序可能同時寫入，等待鎖而非直接失敗
+    conn = sqlite3.connect(str(cache_path), timeout=30, check_same_thread=False)
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created REAL NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access);
+        CREATE TABLE IF NOT EXISTS file_hashes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL
+        );
+        """
+    )
+    return conn
+
+
+def _file_sha256(conn: sqlite3.Connection, path: Path) -> str:
+    """取得檔案 SHA256；(大小, 修改時間) 未變時直接沿用記錄"""
+    stat = path.stat()
+    row = conn.execute(
+        "SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?", (str(path),)
+    ).fetchone()
+    if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+        return row[2]
+    digest = calc_sha256(str(path))
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+            (str(path), stat.st_size, stat.st_mtime_ns, digest),
+        )
+    return digest
+
+
+def model_fingerprint(base_model_path: str, adapter_path: str = None,
+                      cache_path=DEFAULT_CACHE_PATH) -> str:
+    """
+    計算模型指紋（base 權重 + 可選的 LoRA adapter）
+
+    Args:
+        base_model_path: base 模型目錄
+        adapter_path: LoRA adapter 目錄（可選）
+        cache_path: 記錄檔案雜湊的 SQLite 路徑
+
+    Returns:
+        SHA256 十六進位字串
+    """
+    conn = _connect(Path(cache_path))
+    try:
+        sha = hashlib.sha256()
+        for role, model_dir in (("base", base_model_path), ("adapter", adapter_path)):
+            if not model_dir:
+                continue
+            for path in _fingerprint_files(Path(model_dir)):
+                sha.update(f"{role}/{path.name}:{_file_sha256(conn, path.resolve())}\n".encode("utf-8"))
+        return sha.hexdigest()
+    finally:
+        conn.close()
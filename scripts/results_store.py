@@ -0,0 +1,456 @@
+"""
+測試結果資料庫 - 集中儲存所有測試輸出、人工分類標註與比對結果（SQLite）
+
+供 compare_with_standards.py、excel_to_json.py / write_json_to_excel.py 與 UI 共用。
+資料來源（皆位於 test_logs/<語言>/<模型>/ 之下）：
+  *_For_Summary.json      測試輸出摘要（assistant_summary）
+  full/*_For_Text.txt     完整回覆
+  *分析統計表.json 等      人工分類標註（excel_to_json.py 的輸出）
+
+每個目錄視為一次執行（run），鍵為相對於 test_logs 的路徑（如 zh-TW/qwen25_behavior_v4）。
+已匯入的檔案依 (大小, 修改時間) 記錄，重新掃描時只處理有變動的檔案。
+"""
+import argparse
+import json
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+# 動態獲取專案根目錄
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+DEFAULT_DB_PATH = PROJECT_ROOT / "cache" / "results.sqlite"
+TEST_LOGS_DIR = PROJECT_ROOT / "test_logs"
+
+LANGUAGES = ("zh-TW", "zh-CN", "en-US")
+
+# 人工分類欄位（資料庫中各自為一欄，方便跨執行查詢）
+LABEL_FIELDS = (
+    "is_reject", "is_clarify", "is_request_info", "is_allow_risk",
+    "is_contradict", "is_deny", "is_invalid", "need_fix",
+)
+
+# 人工標註檔（excel_to_json.py 輸出）的檔名關鍵字
+ANALYSIS_FILE_KEYWORDS = ("分析統計表", "分析统计表", "AnalysisStatistics")
+
+# excel_to_json.py 輸出結構中的資料鍵（{"<sheet>": {"資料": [...], "統計": {...}}}）
+DATA_KEYS = ("資料", "资料", "data")
+
+_SUMMARY_SUFFIX = "_For_Summary.json"
+_FULL_TEXT_SUFFIX = "_For_Text.txt"
+
+# For_Text 檔案的題目區塊（格式見 eval_utils.format_test_block / build_result_entry）
+_BLOCK_RE = re.compile(r"^▶ \[(?P<qid>[^\]]+)\] 測試項目：(?P<name>.*)$", re.M)
+_FULL_MARKER = "assistant (full):\n"
+_SEPARATOR = "\n" + "-" * 60
+_TRUNCATED_MARKER = "[TRUNCATED IN SUMMARY]"
+
+
+def record_qid(record: dict):
+    """題號：支援 qid / 題號 / 题号 / QID 欄位"""
+    return record.get("qid") or record.get("題號") or record.get("题号") or record.get("QID")
+
+
+def extract_records(data) -> list:
+    """由 JSON 內容取出題目列表：平鋪的 list，或 excel_to_json.py 輸出的第一個含資料的 sheet"""
+    if isinstance(data, dict):
+        for sheet in data.values():
+            if isinstance(sheet, dict):
+                for key in DATA_KEYS:
+                    if isinstance(sheet.get(key), list):
+                        return sheet[key]
+    return data if isinstance(data, list) else []
+
+
+def is_analysis_file(path) -> bool:
+    return any(keyword in Path(path).name for keyword in ANALYSIS_FILE_KEYWORDS)
+
+
+def file_kind(path):
+    """判斷檔案類型：summary / full / labels，無法辨識時回傳 None"""
+    path = Path(path)
+    if path.name.endswith(_SUMMARY_SUFFIX):
+        return "summary"
+    if path.name.endswith(_FULL_TEXT_SUFFIX) and path.parent.name == "full":
+        return "full"
+    if path.suffix == ".json" and is_analysis_file(path):
+        return "labels"
+    return None
+
+
+def run_key_for(path, root=TEST_LOGS_DIR):
+    """
+    由檔案路徑推得 (run_key, 語言, 模型)
+
+    run_key 為所在目錄（full/ 以上一層為準）相對於 root 的路徑；不在 root 之下時使用目錄名稱。
+    """
+    run_dir = Path(path).resolve().parent
+    if run_dir.name == "full":
+        run_dir = run_dir.parent
+    try:
+        parts = run_dir.relative_to(Path(root).resolve()).parts
+    except ValueError:
+        parts = (run_dir.name,)
+    if not parts:
+        parts = (run_dir.name,)
+    lang = parts[0] if parts[0] in LANGUAGES else None
+    model = parts[-1] if len(parts) > 1 or lang is None else None
+    return "/".join(parts), lang, model
+
+
+def parse_full_text(text: str) -> list:
+    """解析 For_Text 檔，回傳 [{qid, name, input, response}, ...]"""
+    records = []
+    matches = list(_BLOCK_RE.finditer(text))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        block = text[match.end():end]
+        input_match = re.search(r"^  使用輸入：(.*)$", block, re.M)
+        start = block.find(_FULL_MARKER)
+        if start < 0:
+            continue
+        body = block[start + len(_FULL_MARKER):]
+        sep = body.rfind(_SEPARATOR)
+        if sep >= 0:
+            body = body[:sep]
+        body = body.rstrip("\n")
+        if body.endswith(_TRUNCATED_MARKER):
+            body = body[:-len(_TRUNCATED_MARKER)].rstrip("\n")
+        records.append({
+            "qid": match.group("qid"),
+            "name": match.group("name").strip(),
+            "input": input_match.group(1) if input_match else None,
+            "response": body,
+        })
+    return records
+
+
+def _label_value(value):
+    """分類欄位轉成整數；空白或非數字存為 NULL"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResultsStore:
+    """
+    測試結果資料庫
+
+    多個程序可共用同一個資料庫檔案（寫入時等待鎖）；同一個物件（連線）則不可由多個
+    執行緒同時使用，例如 UI 的各個 session 應各自開啟。
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = Path(db_path)
+        self._conn = _connect(self.db_path)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------
+    # 匯入
+    # ------------------------------
+    def _run_id(self, run_key: str, lang: str = None, model: str = None) -> int:
+        now = time.time()
+        self._conn.execute(
+            "INSERT INTO runs (run_key, lang, model, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(run_key) DO UPDATE SET "
+            "lang = COALESCE(excluded.lang, lang), model = COALESCE(excluded.model, model), updated = excluded.updated",
+            (run_key, lang, model, now),
+        )
+        return self._conn.execute("SELECT run_id FROM runs WHERE run_key = ?", (run_key,)).fetchone()[0]
+
+    def ingest_responses(self, run_key: str, records: list, lang: str = None, model: str = None):
+        """
+        匯入測試輸出（summary 或完整回覆），同一題的其他欄位保留不變
+
+        Args:
+            run_key: 執行鍵
+            records: [{qid, name, input, assistant_summary 或 response}, ...]
+        """
+        with self._conn:
+            run_id = self._run_id(run_key, lang, model)
+            self._conn.executemany(
+                "INSERT INTO responses (run_id, qid, name, input, summary, full_response) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(run_id, qid) DO UPDATE SET "
+                "name = COALESCE(excluded.name, name), input = COALESCE(excluded.input, input), "
+                "summary = COALESCE(excluded.summary, summary), "
+                "full_response = COALESCE(excluded.full_response, full_response)",
+                [
+                    (run_id, record_qid(r), r.get("name"), r.get("input"),
+                     r.get("assistant_summary"), r.get("response"))
+                    for r in records if isinstance(r, dict) and record_qid(r)
+                ],
+            )
+
+    def ingest_labels(self, run_key: str, records: list, lang: str = None, model: str = None):
+        """匯入人工分類標註（取代該執行先前的標註）；原始欄位另以 JSON 保存"""
+        rows = {}
+        for r in records:
+            if isinstance(r, dict) and record_qid(r):
+                rows[str(record_qid(r)).strip()] = r
+        with self._conn:
+            run_id = self._run_id(run_key, lang, model)
+            self._conn.execute("DELETE FROM labels WHERE run_id = ?", (run_id,))
+            self._conn.executemany(
+                f"INSERT INTO labels (run_id, qid, {', '.join(LABEL_FIELDS)}, record) "
+                f"VALUES (?, ?, {', '.join('?' * len(LABEL_FIELDS))}, ?)",
+                [
+                    (run_id, qid, *(_label_value(r.get(f)) for f in LABEL_FIELDS),
+                     json.dumps(r, ensure_ascii=False, default=str))
+                    for qid, r in rows.items()
+                ],
+            )
+
+    def ingest_file(self, path, root=TEST_LOGS_DIR, force: bool = False) -> bool:
+        """
+        匯入單一結果檔（類型由檔名判斷），(大小, 修改時間) 未變時略過
+
+        Returns:
+            是否有匯入
+        """
+        path = Path(path).resolve()
+        kind = file_kind(path)
+        if kind is None:
+            return False
+        stat = path.stat()
+        if not force:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns FROM files WHERE path = ?", (str(path),)
+            ).fetchone()
+            if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                return False
+
+        run_key, lang, model = run_key_for(path, root)
+        if kind == "full":
+            with open(path, "r", encoding="utf-8") as f:
+                self.ingest_responses(run_key, parse_full_text(f.read()), lang, model)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                records = extract_records(json.load(f))
+            if kind == "summary":
+                self.ingest_responses(run_key, records, lang, model)
+            else:
+                self.ingest_labels(run_key, records, lang, model)
+
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, run_key, kind) VALUES (?, ?, ?, ?, ?)",
+                (str(path), stat.st_size, stat.st_mtime_ns, run_key, kind),
+            )
+        return True
+
+    def ingest_directory(self, root=TEST_LOGS_DIR, force: bool = False) -> dict:
+        """
+        掃描 root 下所有結果檔並匯入有變動的檔案
+
+        Returns:
+            {"scanned": 檔案數, "ingested": 匯入數}
+        """
+        scanned = ingested = 0
+        for path in sorted(Path(root).rglob("*")):
+            if not path.is_file() or file_kind(path) is None:
+                continue
+            scanned += 1
+            try:
+                ingested += self.ingest_file(path, root, force)
+            except (OSError, ValueError) as e:
+                print(f"[WARN] 無法匯入 {path}：{e}")
+        return {"scanned": scanned, "ingested": ingested}
+
+    def save_comparisons(self, run_key: str, standard_lang: str, rows: list):
+        """
+        保存與標準答案的逐題比對結果（取代該執行、該語言標準先前的結果）
+
+        Args:
+            rows: [(qid, correct_dimensions, perfect, errors), ...]，errors 為 {維度: {standard, actual}}
+        """
+        now = time.time()
+        with self._conn:
+            run_id = self._run_id(run_key)
+            self._conn.execute(
+                "DELETE FROM comparisons WHERE run_id = ? AND standard_lang = ?", (run_id, standard_lang)
+            )
+            self._conn.executemany(
+                "INSERT INTO comparisons (run_id, standard_lang, qid, correct_dimensions, perfect, errors, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (run_id, standard_lang, qid, int(correct), int(bool(perfect)),
+                     json.dumps(errors, ensure_ascii=False), now)
+                    for qid, correct, perfect, errors in rows
+                ],
+            )
+
+    # ------------------------------
+    # 查詢
+    # ------------------------------
+    def list_runs(self, lang: str = None, with_labels: bool = False) -> list:
+        """所有執行及其題數（可依語言篩選、只列出有標註的執行）"""
+        sql = (
+            "SELECT r.run_key, r.lang, r.model, "
+            "(SELECT COUNT(*) FROM responses WHERE run_id = r.run_id) AS responses, "
+            "(SELECT COUNT(*) FROM labels WHERE run_id = r.run_id) AS labels "
+            "FROM runs r WHERE (? IS NULL OR r.lang = ?) ORDER BY r.run_key"
+        )
+        rows = [
+            {"run_key": k, "lang": l, "model": m, "responses": n_resp, "labels": n_lab}
+            for k, l, m, n_resp, n_lab in self._conn.execute(sql, (lang, lang))
+        ]
+        return [r for r in rows if r["labels"]] if with_labels else rows
+
+    def get_labels(self, run_key: str) -> list:
+        """某次執行的人工標註（原始欄位，依題號排序）"""
+        rows = self._conn.execute(
+            "SELECT l.record FROM labels l JOIN runs r ON r.run_id = l.run_id "
+            "WHERE r.run_key = ? ORDER BY l.qid",
+            (run_key,),
+        )
+        return [json.loads(record) for (record,) in rows]
+
+    def get_responses(self, run_key: str) -> list:
+        """某次執行的測試輸出（依題號排序）"""
+        rows = self._conn.execute(
+            "SELECT s.qid, s.name, s.input, s.summary, s.full_response FROM responses s "
+            "JOIN runs r ON r.run_id = s.run_id WHERE r.run_key = ? ORDER BY s.qid",
+            (run_key,),
+        )
+        return [
+            {"qid": q, "name": n, "input": i, "assistant_summary": s, "response": f}
+            for q, n, i, s, f in rows
+        ]
+
+    def label_summary(self, lang: str = None) -> list:
+        """每次執行各分類欄位的標註數（SUM），供跨版本比較"""
+        sums = ", ".join(f"SUM(l.{f}) AS {f}" for f in LABEL_FIELDS)
+        rows = self._conn.execute(
+            f"SELECT r.run_key, COUNT(*) AS total, {sums} FROM labels l JOIN runs r ON r.run_id = l.run_id "
+            "WHERE (? IS NULL OR r.lang = ?) GROUP BY r.run_key ORDER BY r.run_key",
+            (lang, lang),
+        )
+        columns = ["run_key", "total", *LABEL_FIELDS]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def comparison_summary(self, standard_lang: str = None) -> list:
+        """每次執行與標準答案的比對結果（完全正確題數與比例）"""
+        rows = self._conn.execute(
+            "SELECT r.run_key, c.standard_lang, COUNT(*), SUM(c.perfect), SUM(c.correct_dimensions) "
+            "FROM comparisons c JOIN runs r ON r.run_id = c.run_id "
+            "WHERE (? IS NULL OR c.standard_lang = ?) "
+            "GROUP BY r.run_key, c.standard_lang ORDER BY c.standard_lang, r.run_key",
+            (standard_lang, standard_lang),
+        )
+        return [
+            {"run_key": k, "standard_lang": l, "questions": n, "perfect": p,
+             "perfect_rate": round(p / n * 100, 2) if n else 0.0, "correct_dimensions": c}
+            for k, l, n, p, c in rows
+        ]
+
+    def question_across_runs(self, qid: str, lang: str = None) -> list:
+        """同一題在所有執行中的回覆摘要與標註"""
+        labels = ", ".join(f"l.{f}" for f in LABEL_FIELDS)
+        rows = self._conn.execute(
+            f"SELECT r.run_key, s.name, s.summary, {labels} FROM runs r "
+            "LEFT JOIN responses s ON s.run_id = r.run_id AND s.qid = ? "
+            "LEFT JOIN labels l ON l.run_id = r.run_id AND l.qid = ? "
+            "WHERE (s.qid IS NOT NULL OR l.qid IS NOT NULL) AND (? IS NULL OR r.lang = ?) "
+            "ORDER BY r.run_key",
+            (qid, qid, lang, lang),
+        )
+        columns = ["run_key", "name", "assistant_summary", *LABEL_FIELDS]
+        return [dict(zip(columns, row)) for row in rows]
+
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    # 測試腳本、轉換工具與 UI 可能同時寫入，等待鎖而非直接失敗
+    conn = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+    label_columns = "".join(f"            {f} INTEGER,\n" for f in LABEL_FIELDS)
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id INTEGER PRIMARY KEY,
+            run_key TEXT NOT NULL UNIQUE,
+            lang TEXT,
+            model TEXT,
+            updated REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_runs_lang_model ON runs (lang, model);
+        CREATE TABLE IF NOT EXISTS responses (
+            run_id INTEGER NOT NULL REFERENCES runs (run_id),
+            qid TEXT NOT NULL,
+            name TEXT,
+            input TEXT,
+            summary TEXT,
+            full_response TEXT,
+            PRIMARY KEY (run_id, qid)
+        );
+        CREATE INDEX IF NOT EXISTS idx_responses_qid ON responses (qid);
+        CREATE TABLE IF NOT EXISTS labels (
+            run_id INTEGER NOT NULL REFERENCES runs (run_id),
+            qid TEXT NOT NULL,
+{label_columns}            record TEXT NOT NULL,
+            PRIMARY KEY (run_id, qid)
+        );
+        CREATE INDEX IF NOT EXISTS idx_labels_qid ON labels (qid);
+        CREATE TABLE IF NOT EXISTS comparisons (
+            run_id INTEGER NOT NULL REFERENCES runs (run_id),
+            standard_lang TEXT NOT NULL,
+            qid TEXT NOT NULL,
+            correct_dimensions INTEGER NOT NULL,
+            perfect INTEGER NOT NULL,
+            errors TEXT NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (run_id, standard_lang, qid)
+        );
+        CREATE INDEX IF NOT EXISTS idx_comparisons_qid ON comparisons (qid);
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            run_key TEXT NOT NULL,
+            kind TEXT NOT NULL
+        );
+        """
+    )
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="測試結果資料庫：匯入 test_logs 並查詢")
+    parser.add_argument("--root", default=str(TEST_LOGS_DIR), help="掃描的根目錄（預設 test_logs）")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH), help="SQLite 資料庫路徑")
+    parser.add_argument("--force", action="store_true", help="忽略匯入記錄，全部重新匯入")
+    parser.add_argument("--lang", choices=LANGUAGES, default=None, help="只列出指定語言的執行")
+    parser.add_argument("--qid", default=None, help="列出某題在所有執行中的結果")
+
+    args = parser.parse_args()
+    store = ResultsStore(args.db)
+    try:
+        start = time.perf_counter()
+        counts = store.ingest_directory(args.root, force=args.force)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"掃描 {counts['scanned']} 個結果檔，匯入 {counts['ingested']} 個（{elapsed:.0f} ms）")
+
+        if args.qid:
+            for row in store.question_across_runs(args.qid, args.lang):
+                labels = " ".join(f"{f}={row[f]}" for f in LABEL_FIELDS if row[f])
+                print(f"  {row['run_key']}: {labels or '-'}")
+            return
+
+        for run in store.list_runs(args.lang):
+            print(f"  {run['run_key']}: 回覆 {run['responses']} 題，標註 {run['labels']} 題")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
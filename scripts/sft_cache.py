@@ -0,0 +1,301 @@
+"""
+訓練資料 token 快取 - 供 train_lora.py 使用
+
+behavior_dataset.jsonl 只在第一次訓練時 tokenize，結果寫入：
+  tokens.bin  所有樣本的 input_ids 串接（int32，以 memmap 讀取）
+  index.npy   每筆樣本的 (起始位置, 長度, label 起始位置)
+  meta.json   快取鍵的組成與統計
+
+快取鍵 = 資料集檔案雜湊 + tokenizer 雜湊 + 前處理設定（system prompt、max_length、
+label masking 方式等），任一項改變都會自動重建，其餘情況直接沿用。
+
+另外提供單次串流讀取的 JSONL 驗證 + 解析（大檔案分塊交給多程序處理），
+驗證結果同樣以檔案雜湊快取；以及依樣本內容雜湊計算兩個資料集版本之間的差異（增量訓練用）。
+"""
+import hashlib
+import json
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+
+from check_model_hash import calc_sha256
+
+# 動態獲取專案根目錄
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+DEFAULT_CACHE_ROOT = PROJECT_ROOT / "cache" / "sft_tokens"
+CACHE_FORMAT_VERSION = 1
+
+# tokenizer 目錄中決定分詞結果的檔案
+_TOKENIZER_FILES = (
+    "tokenizer.json", "tokenizer_config.json", "vocab.json", "merges.txt",
+    "special_tokens_map.json", "added_tokens.json", "tokenizer.model",
+)
+
+# 每次送入 tokenizer 的樣本數（fast tokenizer 會在批次內平行處理）
+_ENCODE_BATCH_SIZE = 256
+
+# 訓練樣本必備欄位
+REQUIRED_FIELDS = ("instruction", "input", "output")
+# 檔案超過此大小才改用多程序解析（小檔案啟動程序的成本反而較高）
+_PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+_PARSE_CHUNK_LINES = 5000
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """tokenizer 雜湊：優先使用目錄中的 tokenizer 檔案，找不到時改用詞表內容"""
+    sha = hashlib.sha256()
+    sha.update(f"{type(tokenizer).__name__}:{len(tokenizer)}\n".encode("utf-8"))
+    tokenizer_dir = Path(getattr(tokenizer, "name_or_path", "") or "")
+    files = [tokenizer_dir / name for name in _TOKENIZER_FILES if (tokenizer_dir / name).is_file()]
+    if files:
+        for path in files:
+            sha.update(f"{path.name}:{calc_sha256(str(path))}\n".encode("utf-8"))
+    else:
+        vocab = json.dumps(tokenizer.get_vocab(), ensure_ascii=False, sort_keys=True)
+        sha.update(vocab.encode("utf-8"))
+    return sha.hexdigest()
+
+
+def cache_key(dataset_path, tokenizer, preprocess_config: dict, dataset_hash: str = None) -> str:
+    """快取鍵：資料集雜湊 + tokenizer 雜湊 + 前處理設定"""
+    payload = json.dumps(
+        {
+            "format": CACHE_FORMAT_VERSION,
+            "dataset": dataset_hash or calc_sha256(str(dataset_path)),
+            "tokenizer": tokenizer_fingerprint(tokenizer),
+            "preprocess": preprocess_config,
+        },
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _parse_chunk(chunk):
+    """解析一段 (起始行號, 行列表)，回傳 (records, errors, 行數)"""
+    first_lineno, lines = chunk
+    records, errors = [], []
+    for lineno, line in enumerate(lines, first_lineno):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            errors.append(f"第 {lineno} 行: {str(e)[:100]}")
+            continue
+        if not isinstance(record, dict):
+            errors.append(f"第 {lineno} 行: 不是 JSON 物件")
+            continue
+        missing = [k for k in REQUIRED_FIELDS if not isinstance(record.get(k), str)]
+        if missing:
+            errors.append(f"第 {lineno} 行: 缺少欄位或不是字串 {', '.join(missing)}")
+            continue
+        records.append(record)
+    return records, errors, len(lines)
+
+
+def _iter_chunks(f):
+    lineno = 1
+    while True:
+        lines = list(islice(f, _PARSE_CHUNK_LINES))
+        if not lines:
+            return
+        yield lineno, lines
+        lineno += len(lines)
+
+
+def _map_bounded(pool, func, items, window: int):
+    """
+    依序回傳 func(item) 的結果，同時最多 window 個 item 在處理中
+
+    Executor.map 會先把所有 item 讀完並送出；這裡讀一塊送一塊，
+    大檔案在記憶體中只保留 window 個區塊。
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def parse_jsonl(dataset_path, workers: int = None):
+    """
+    單次串流讀取並驗證 JSONL（允許 BOM 與空行），檔案較大時分塊交給多程序解析
+    （同時最多 2 × 程序數個區塊在處理中，不會一次讀入整個檔案）
+
+    Args:
+        dataset_path: JSONL 路徑
+        workers: 程序數（None 依 CPU 數決定，1 表示不使用多程序）
+
+    Returns:
+        (records, errors, total_lines)；records 依檔案順序，只含通過驗證的樣本
+    """
+    parallel = workers != 1 and os.path.getsize(dataset_path) >= _PARALLEL_MIN_BYTES
+    records, errors, total_lines = [], [], 0
+    with open(dataset_path, "r", encoding="utf-8-sig") as f:
+        chunks = _iter_chunks(f)
+        if parallel:
+            workers = workers or os.cpu_count() or 1
+            pool = ProcessPoolExecutor(max_workers=workers)
+            results = _map_bounded(pool, _parse_chunk, chunks, 2 * workers)
+        else:
+            results = map(_parse_chunk, chunks)
+        try:
+            for chunk_records, chunk_errors, n_lines in results:
+                records.extend(chunk_records)
+                errors.extend(chunk_errors)
+                total_lines += n_lines
+        finally:
+            if parallel:
+                pool.shutdown()
+    return records, errors, total_lines
+
+
+def load_validated_jsonl(dataset_path, dataset_hash: str = None, cache_root=DEFAULT_CACHE_ROOT,
+                         workers: int = None):
+    """
+    驗證訓練集，結果以檔案雜湊快取
+
+    曾驗證通過的同一份檔案不會再解析（records 回傳 None，需要時由
+    load_or_build_token_cache 再讀取；token 快取命中時則完全不必解析）。
+
+    Returns:
+        (records 或 None, errors, valid_count, total_lines)
+    """
+    dataset_hash = dataset_hash or calc_sha256(str(dataset_path))
+    result_path = Path(cache_root) / "validation" / f"{dataset_hash}.json"
+    if result_path.exists():
+        with open(result_path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        if not result["errors"]:
+            return None, [], result["valid_count"], result["total_lines"]
+
+    records, errors, total_lines = parse_jsonl(dataset_path, workers)
+    result_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump({"valid_count": len(records), "total_lines": total_lines, "errors": errors},
+                  f, ensure_ascii=False)
+    return records, errors, len(records), total_lines
+
+
+def read_jsonl(dataset_path) -> list:
+    """讀取訓練集 JSONL（只回傳通過驗證的樣本）"""
+    return parse_jsonl(dataset_path)[0]
+
+
+def record_hash(record: dict) -> str:
+    """樣本內容雜湊（只看 instruction / input / output，與欄位順序和其他欄位無關）"""
+    payload = json.dumps([record[k] for k in REQUIRED_FIELDS], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def dataset_delta(records: list, previous_records: list):
+    """
+    依內容雜湊比對新舊版本的訓練集
+
+    Returns:
+        (new_indices, old_indices)：records 中新增樣本與舊版已有樣本的索引
+    """
+    previous = {record_hash(r) for r in previous_records}
+    new_indices, old_indices = [], []
+    for i, record in enumerate(records):
+        (old_indices if record_hash(record) in previous else new_indices).append(i)
+    return new_indices, old_indices
+
+
+class TokenCache:
+    """以 memmap 讀取的 token 快取；get(i) 回傳 (input_ids, label_start)"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.index = np.load(self.cache_dir / "index.npy")
+        tokens_path = self.cache_dir / "tokens.bin"
+        # 空檔案無法 memmap（資料集為空時）
+        if tokens_path.stat().st_size:
+            self.tokens = np.memmap(tokens_path, dtype=np.int32, mode="r")
+        else:
+            self.tokens = np.zeros(0, dtype=np.int32)
+        with open(self.cache_dir / "meta.json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, idx: int):
+        offset, length, label_start = (int(x) for x in self.index[idx])
+        return self.tokens[offset:offset + length], label_start
+
+    def lengths(self) -> np.ndarray:
+        """每筆樣本的 token 數"""
+        return self.index[:, 1]
+
+
+def _write_cache(cache_dir: Path, encoded: list, meta: dict):
+    """寫入暫存目錄後再改名，避免中斷時留下不完整的快取"""
+    tmp_dir = cache_dir.with_name(f"{cache_dir.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    index = np.zeros((len(encoded), 3), dtype=np.int64)
+    offset = 0
+    with open(tmp_dir / "tokens.bin", "wb") as f:
+        for i, (ids, label_start) in enumerate(encoded):
+            np.asarray(ids, dtype=np.int32).tofile(f)
+            index[i] = (offset, len(ids), label_start)
+            offset += len(ids)
+    np.save(tmp_dir / "index.npy", index)
+
+    meta = {**meta, "examples": len(encoded), "tokens": offset}
+    with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # 其他程序已先建立相同的快取，直接沿用
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_or_build_token_cache(dataset_path, tokenizer, encode_batch, preprocess_config: dict,
+                              cache_root=DEFAULT_CACHE_ROOT, records: list = None,
+                              dataset_hash: str = None) -> TokenCache:
+    """
+    取得訓練集的 token 快取，不存在時 tokenize 一次並寫入
+
+    Args:
+        dataset_path: 訓練集 JSONL 路徑
+        tokenizer: 分詞器（用於計算快取鍵）
+        encode_batch: 函式，輸入樣本列表，回傳 [(input_ids, label_start), ...]
+        preprocess_config: 影響 tokenize 結果的設定（會納入快取鍵）
+        cache_root: 快取根目錄
+        records: 已解析的樣本（可選，避免重複讀檔）
+        dataset_hash: 已計算的資料集雜湊（可選）
+
+    Returns:
+        TokenCache
+    """
+    key = cache_key(dataset_path, tokenizer, preprocess_config, dataset_hash)
+    cache_dir = Path(cache_root) / key
+    if (cache_dir / "meta.json").exists():
+        print(f"[快取] 沿用已 tokenize 的訓練集：{cache_dir}")
+        return TokenCache(cache_dir)
+
+    print(f"[快取] 建立 token 快取：{cache_dir}")
+    if records is None:
+        records = read_jsonl(dataset_path)
+    encoded = []
+    for start in range(0, len(records), _ENCODE_BATCH_SIZE):
+        encoded.extend(encode_batch(records[start:start + _ENCODE_BATCH_SIZE]))
+
+    _write_cache(cache_dir, encoded, {
+        "dataset_path": str(dataset_path),
+        "preprocess": preprocess_config,
+    })
+    return TokenCache(cache_dir)
@@ -9,6 +9,15 @@ from transformers import AutoTokenizer, AutoModelForCausalLM
 from peft import PeftModel
 from pathlib import Path
 
+# 確保能找到 chat 模組
+_script_dir = Path(__file__).resolve().parent
+if str(_script_dir) not in sys.path:
+    sys.path.insert(0, str(_script_dir))
+
+from chat import generate_reply, generate_reply_batch, format_qwen_system_prefix, ChatSession
+from response_cache import ResponseCache
+from eval_utils import make_qid, journal_path_for, parse_shard, pin_worker_threads, run_test_suite
+
 # 載入測試集前，先解析語言參數
 current_file = Path(__file__).resolve()
 parent_dir = current_file.parent.parent
@@ -25,8 +34,26 @@ parser.add_argument('--lora', type=str, default=None,
 parser.add_argument('--test_file', type=str, default=None,
                     help='測試集檔案完整路徑（若不指定則使用預設 test_cases_200.jsonl）')
 parser.add_argument('--no-clean', action='store_true', help='skip assistant_summary cleaning step')
+parser.add_argument('--batch-size', type=int, default=1,
+                    help='每批一起生成的測試題數（左側補齊後批次 generate），預設為 1（逐題）')
+parser.add_argument('--multi-turn', action='store_true',
+                    help='多輪對話模式：所有測試題依序在同一段對話中提問（例如 test_cases_for_multiple_rounds.jsonl）')
+parser.add_argument('--resume', action='store_true',
+                    help='從 journal 續跑：略過已完成的題目，最後由 journal 重建輸出檔')
+parser.add_argument('--no-cache', action='store_true',
+                    help='停用回應快取（模型權重與生成參數未變時，直接沿用先前的回覆）')
+parser.add_argument('--workers', type=int, default=1,
+                    help='多程序分片執行：每個程序各自載入模型並綁定部分 CPU 核心（或一張 GPU），預設為 1')
+# 內部使用：由 --workers 主程序指定子程序負責的分片（i/N）
+parser.add_argument('--shard', type=str, default=None, help=argparse.SUPPRESS)
 args = parser.parse_args()
 
+NUM_WORKERS = max(1, args.workers)
+if NUM_WORKERS > 1 and args.multi_turn:
+    print("[WARN] 多輪對話需依序進行，無法分片，改以單一程序執行\n")
+    NUM_WORKERS = 1
+SHARD = parse_shard(args.shard) if args.shard else None
+
 TEST_LANGUAGE = args.lang
 print(f"[訓練] 使用語言：{TEST_LANGUAGE}\n")
 
@@ -89,27 +116,46 @@ else:
         print(f"   請先執行訓練：python scripts/train_qwen3b_lora.py --lang {TEST_LANGUAGE}")
         sys.exit(1)
 
-print("[處理] 載入 tokenizer...")
-tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, trust_remote_code=True)
+if SHARD is not None:
+    num_threads = pin_worker_threads(*SHARD)
+    torch.set_num_threads(num_threads)
+    print(f"[分片] 分片 {SHARD[0] + 1}/{SHARD[1]}，使用 {num_threads} 個執行緒\n")
 
-print("[處理] 載入 base 模型...")
-model = AutoModelForCausalLM.from_pretrained(
-    BASE_MODEL,
-    device_map="auto",
-    torch_dtype=torch.bfloat16,
-    trust_remote_code=True
-)
+if NUM_WORKERS > 1:
+    # 主程序只負責分派與合併，模型由各分片程序自行載入
+    tokenizer = model = None
+else:
+    print("[處理] 載入 tokenizer...")
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, trust_remote_code=True)
+    # 批次生成需左側補齊，讓每題的生成位置都緊接在 prompt 之後
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    print("[處理] 載入 base 模型...")
+    model = AutoModelForCausalLM.from_pretrained(
+        BASE_MODEL,
+        device_map="auto",
+        torch_dtype=torch.bfloat16,
+        trust_remote_code=True
+    )
 
-print("[處理] 套用 LoRA 權重...")
-model = PeftModel.from_pretrained(model, LORA_PATH)
-model.eval()
+    print("[處理] 套用 LoRA 權重...")
+    model = PeftModel.from_pretrained(model, LORA_PATH)
+    model.eval()
+
+# 回應快取：以 base 權重 + LoRA adapter 的雜湊為指紋，權重變動後自動失效
+RESPONSE_CACHE = None
+if not args.no_cache and model is not None:
+    print("[處理] 計算模型指紋（回應快取）...")
+    RESPONSE_CACHE = ResponseCache.for_model(BASE_MODEL, LORA_PATH)
 
 
 # ------------------------------
 # 正確的 Qwen Chat Prompt
 # ------------------------------
-def ask(user_msg: str):
-    prompt = (
+def build_prompt(user_msg: str) -> str:
+    return (
         "<|im_start|>system\n"
         + SYSTEM_PROMPT +
         "\n<|im_end|>\n"
@@ -119,26 +165,46 @@ def ask(user_msg: str):
         "<|im_start|>assistant\n"
     )
 
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=256,
-            temperature=0.4,
-            top_p=0.9,
-            repetition_penalty=1.1
-        )
-
-    full = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    # 僅保留 assistant 回覆內容，不含 prompt
-    # 嘗試從最後一個 <|im_start|>assistant 之後取內容
-    assistant_tag = "<|im_start|>assistant"
-    if assistant_tag in full:
-        answer = full.split(assistant_tag)[-1].strip()
-    else:
-        answer = full.strip()
-    return answer
+
+GENERATION_KWARGS = dict(
+    max_new_tokens=256,
+    temperature=0.4,
+    top_p=0.9,
+    repetition_penalty=1.1
+)
+
+
+def ask(user_msg: str):
+    prompt = build_prompt(user_msg)
+
+    # system prompt 前綴的 KV 只計算一次，之後每題只需 prefill user 部分；
+    # 遇到 <|im_end|> 或角色標記即停止，只解碼 assistant 新生成的內容
+    return generate_reply(
+        tokenizer, model, prompt, format_qwen_system_prefix(SYSTEM_PROMPT),
+        response_cache=RESPONSE_CACHE, **GENERATION_KWARGS
+    )
+
+
+def ask_batch(user_msgs: list) -> list:
+    """一次生成多題回覆（左側補齊），回傳順序與輸入相同"""
+    prompts = [build_prompt(m) for m in user_msgs]
+    return generate_reply_batch(tokenizer, model, prompts, response_cache=RESPONSE_CACHE, **GENERATION_KWARGS)
+
+
+def generate_multi_turn_responses(tests: list, completed: dict = None):
+    """多輪對話模式：依序在同一個 ChatSession 中提問，逐題 yield (idx, test, response)
+
+    續跑時已完成的回合直接併入對話歷史，不重新生成。
+    """
+    completed = completed or {}
+    session = ChatSession(tokenizer, model, TEST_LANGUAGE, system_prompt=SYSTEM_PROMPT,
+                          response_cache=RESPONSE_CACHE, **GENERATION_KWARGS)
+    for idx, t in enumerate(tests, 1):
+        record = completed.get(make_qid(idx))
+        if record is not None:
+            session.append_turn(t["input"], record["response"])
+            continue
+        yield idx, t, session.ask(t["input"])
 
 
 # ------------------------------
@@ -227,67 +293,38 @@ header = (
 
 print(header)
 
-import json as _json
-with open(output_path, "w", encoding="utf-8") as f_summary, open(output_full_path, "w", encoding="utf-8") as f_full:
-    # 寫入標頭到 full 檔案
-    f_full.write(header)
+# journal：每題完成即追加寫入，中斷後可用 --resume 續跑
+journal_path = journal_path_for(output_dir, lora_model_name)
 
-    summary_json = []
+written = run_test_suite(
+    tests, journal_path, output_path, output_full_path, header, ask, ask_batch,
+    batch_size=args.batch_size, multi_turn=generate_multi_turn_responses if args.multi_turn else None,
+    resume=args.resume, num_workers=NUM_WORKERS, shard=SHARD,
+    script_path=Path(__file__).resolve(), argv=sys.argv[1:],
+    gpu_count=torch.cuda.device_count() if NUM_WORKERS > 1 and torch.cuda.is_available() else 0,
+    max_summary_chars=MAX_SUMMARY_CHARS,
+)
 
-    for idx, t in enumerate(tests, 1):
-        q_id = f"Q{idx:03d}"  # Q001, Q002, ... Q200
-        block = (
-            f"▶ [{q_id}] 測試項目：{t['name']}\n"
-            f"  使用輸入：{t['input']}\n\n"
-        )
-        # 寫入測試標題與輸入到 full 檔案
-        print(block)
-        f_full.write(block)
-
-        response = ask(t["input"])
-
-        # 清理回覆（單行化以便 summary 檔閱讀，且只保留 AI 回答內容）
-        response_single = response.replace('\r', ' ').replace('\n', ' ').strip()
-
-        # 建 summary（無截斷限制）
-        summary = response_single
-        truncated_flag = False
-
-        # 寫入 summary JSON 物件，只保留 AI 回答內容
-        summary_json.append({
-            "qid": q_id,
-            "name": t["name"],
-            "input": t["input"],
-            "assistant_summary": summary
-        })
-
-        # full 檔案保持原樣
-        full_block = (
-            "assistant (full):\n"
-            + response + "\n"
-            + ("[TRUNCATED IN SUMMARY]\n" if truncated_flag else "")
-            + "\n" + "-" * 60 + "\n\n"
-        )
-        f_full.write(full_block)
-
-        # 於終端印出完整回覆（保持原來的 format），檔案層級則維持 summary / full 分離
-        print(full_block)
-
-    # 輸出 summary 為 JSON 格式
-    _json.dump(summary_json, f_summary, ensure_ascii=False, indent=2)
-
-    # 統計摘要
-    total = len(tests)
-    print(f"\n[SUCCESS] 測試完成！")
-    print(f"[檔案] JSON 摘要已寫入：{output_path}")
-    print(f"[檔案] 完整回覆已寫入：{output_full_path}")
-    print(f"[統計] 總測試數：{total} 個")
-    print(f"\n 提示：請手動檢查回覆進行人工判斷分類")
-    print(f"   - 拒絕 (Reject)")
-    print(f"   - 澄清 (Clarify)")
-    print(f"   - 危險允許 (Allow Risk)")
-    print(f"   - 否認 (Deny)")
-    print(f"   - 無效 (Invalid)")
+if SHARD is not None:
+    # 分片程序只負責生成，輸出檔由主程序合併後產生
+    if RESPONSE_CACHE is not None:
+        print(f"[快取] 回應快取{RESPONSE_CACHE.stats()}")
+    sys.exit(0)
+
+# 統計摘要
+total = written
+print(f"\n[SUCCESS] 測試完成！")
+print(f"[檔案] JSON 摘要已寫入：{output_path}")
+print(f"[檔案] 完整回覆已寫入：{output_full_path}")
+print(f"[統計] 總測試數：{total} 個")
+if RESPONSE_CACHE is not None:
+    print(f"[快取] 回應快取{RESPONSE_CACHE.stats()}")
+print(f"\n 提示：請手動檢查回覆進行人工判斷分類")
+print(f"   - 拒絕 (Reject)")
+print(f"   - 澄清 (Clarify)")
+print(f"   - 危險允許 (Allow Risk)")
+print(f"   - 否認 (Deny)")
+print(f"   - 無效 (Invalid)")
 
 # ---------- 自動清理 assistant_summary ----------
 if not args.no_clean:
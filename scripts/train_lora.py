@@ -1,13 +1,20 @@
+import copy
 import json
+import math
+import time
+import queue
+import threading
 import torch
 import csv
 import argparse
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict, List
 from datetime import datetime
 import os
+import sys
 from pathlib import Path
 
+import numpy as np
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
@@ -16,37 +23,38 @@ from transformers import (
     Trainer,
     TrainerCallback,
 )
-from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
+from peft import LoraConfig, PeftModel, get_peft_model, get_peft_model_state_dict, prepare_model_for_kbit_training
+from peft.utils import SAFETENSORS_WEIGHTS_NAME
+from safetensors.torch import save_file
+
+# 確保能找到 sft_cache 模組
+_script_dir = Path(__file__).resolve().parent
+if str(_script_dir) not in sys.path:
+    sys.path.insert(0, str(_script_dir))
+
+from check_model_hash import calc_sha256
+from sft_cache import TokenCache, dataset_delta, load_or_build_token_cache, load_validated_jsonl, read_jsonl
+from model_utils import generate_reply_batch
 
 
 # -------------------------------------------------------
 # JSONL 驗證函數
 # -------------------------------------------------------
-def validate_jsonl(file_path: str) -> tuple[bool, str]:
+def validate_jsonl(file_path: str, dataset_hash: str = None) -> tuple[bool, str, list]:
     """
-    驗證 JSONL 檔案格式
+    驗證 JSONL 檔案格式與必備欄位（instruction / input / output），並同時解析
+    
+    單次串流讀取，大檔案分塊交給多程序；同一份檔案（依雜湊）驗證通過後不再重複解析。
     
     Returns:
-        (is_valid, message): (是否有效, 訊息)
+        (is_valid, message, records): (是否有效, 訊息, 解析後的樣本；驗證結果來自快取時為 None)
     """
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
     print(f"[驗證] 驗證 JSONL 檔案: {file_path}")
-    print(f"   總行數: {len(lines)}")
-    
-    errors = []
-    valid_count = 0
-    
-    for i, line in enumerate(lines, 1):
-        if not line.strip():
-            continue
-        
-        try:
-            json.loads(line)
-            valid_count += 1
-        except json.JSONDecodeError as e:
-            errors.append(f"第 {i} 行: {str(e)[:100]}")
+    records, errors, valid_count, total_lines = load_validated_jsonl(file_path, dataset_hash)
+    if records is None:
+        print(f"   （沿用先前的驗證結果）")
+    print(f"   總行數: {total_lines}")
     
     if errors:
         message = f"\n[ERROR] 找到 {len(errors)} 個 JSON 格式錯誤:\n"
@@ -54,30 +62,68 @@ def validate_jsonl(file_path: str) -> tuple[bool, str]:
             message += f"   {err}\n"
         if len(errors) > 10:
             message += f"   ... 還有 {len(errors) - 10} 個錯誤\n"
-        return False, message
+        return False, message, records
     else:
         message = f"[SUCCESS] JSONL 格式驗證通過！({valid_count} 筆有效資料)"
-        return True, message
+        return True, message, records
 
 
 # -------------------------------------------------------
 # 訓練指標記錄器
 # -------------------------------------------------------
+# 背景寫入執行緒的結束訊號
+_STOP = object()
+
+
 class MetricsLogger:
-    """記錄訓練過程中的所有指標"""
+    """
+    記錄訓練過程中的所有指標
+
+    寫檔由背景執行緒負責（緩衝寫入，每 flush_interval 秒與結束時 flush），
+    log_metrics 只把紀錄放進佇列，不會讓訓練迴圈等待檔案 I/O。
+    """
+    
+    CSV_FIELDS = ['epoch', 'step', 'loss', 'grad_norm', 'learning_rate',
+                  'step_time', 'tokens_per_sec', 'timestamp']
     
-    def __init__(self, output_dir: str):
+    def __init__(self, output_dir: str, flush_interval: float = 10.0,
+                 name: str = "training_metrics", fields: List[str] = None):
         self.output_dir = output_dir
-        self.metrics_file = os.path.join(output_dir, "training_metrics.csv")
+        self.fields = fields or self.CSV_FIELDS
+        self.metrics_file = os.path.join(output_dir, f"{name}.csv")
+        self.json_file = os.path.join(output_dir, f"{name}.json")
+        self.parquet_file = os.path.join(output_dir, f"{name}.parquet")
         self.metrics_list = []
+        self.flush_interval = flush_interval
         
-        # 建立 CSV 標題
+        # 建立 CSV 標題（檔案保持開啟，由背景執行緒寫入）
         os.makedirs(output_dir, exist_ok=True)
-        with open(self.metrics_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['epoch', 'step', 'loss', 'grad_norm', 'learning_rate', 'timestamp'])
+        self._file = open(self.metrics_file, 'w', newline='', encoding='utf-8', buffering=64 * 1024)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.fields)
+        
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+    
+    def _write_loop(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                break
+            if record is not None:
+                self._writer.writerow([record.get(k) for k in self.fields])
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.flush()
     
-    def log_metrics(self, epoch: float, step: int, loss: float, grad_norm: float, lr: float):
+    def log_metrics(self, epoch: float, step: int, loss: float, grad_norm: float, lr: float,
+                    step_time: float = None, tokens_per_sec: float = None):
         """記錄一條訓練指標"""
         record = {
             'epoch': epoch,
@@ -85,18 +131,39 @@ class MetricsLogger:
             'loss': loss,
             'grad_norm': grad_norm,
             'learning_rate': lr,
-            'timestamp': datetime.now().isoformat()
+            'step_time': step_time,
+            'tokens_per_sec': tokens_per_sec,
         }
+        self.log_record(record)
+    
+    def log_record(self, record: Dict):
+        """記錄任意欄位的一筆紀錄（自動補上 timestamp）"""
+        record = {**record, 'timestamp': datetime.now().isoformat()}
         self.metrics_list.append(record)
-        
-        # 實時寫入 CSV
-        with open(self.metrics_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([epoch, step, loss, grad_norm, lr, record['timestamp']])
+        self._queue.put(record)
     
-    def save_json(self):
-        """保存為 JSON 格式"""
-
+    def close(self):
+        """寫完佇列中的紀錄並關閉 CSV（可重複呼叫）"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if not self._file.closed:
+            self._file.close()
+    
+    def save_json(self, parquet: bool = False):
+        """保存為 JSON 格式（parquet=True 時另存欄式 Parquet，需要 pandas + pyarrow）"""
+        self.close()
+        with open(self.json_file, 'w', encoding='utf-8') as f:
+            json.dump(self.metrics_list, f, ensure_ascii=False, indent=2)
+        
+        if parquet:
+            try:
+                import pandas as pd
+                pd.DataFrame(self.metrics_list, columns=self.fields).to_parquet(self.parquet_file, index=False)
+            except ImportError as e:
+                print(f"[WARN] 無法輸出 Parquet（{e}），僅保存 CSV / JSON")
+                return False
+        return True
 
 
 # -------------------------------------------------------
@@ -108,8 +175,19 @@ class MetricsCallback(TrainerCallback):
     def __init__(self, metrics_logger: MetricsLogger, model):
         self.metrics_logger = metrics_logger
         self.model = model
+        self._last_time = None
+        self._last_step = 0
+        self._last_tokens = 0
+    
+    def on_train_begin(self, args, state, control, **kwargs):
+        self._last_time = time.perf_counter()
+        self._last_step = state.global_step
+        self._last_tokens = state.num_input_tokens_seen
+    
+    def on_evaluate(self, args, state, control, **kwargs):
+        # 評估期間不算入訓練吞吐量，從評估結束重新計算
+        self.on_train_begin(args, state, control)
     
-
     def on_log(self, args, state, control, logs=None, **kwargs):
         """在 Trainer log 時記錄指標（此時 grad_norm 若有會被 log）"""
         if logs and 'loss' in logs:
@@ -118,18 +196,247 @@ class MetricsCallback(TrainerCallback):
             loss = logs.get('loss', 0)
             lr = logs.get('learning_rate', args.learning_rate)
             grad_norm = logs.get('grad_norm', 0.0)  # 若 Trainer 有 log grad_norm
-            self.metrics_logger.log_metrics(epoch, step, loss, grad_norm, lr)
+            
+            # 以兩次 log 之間的平均計算每步時間與吞吐量（不在每一步額外計時）
+            now = time.perf_counter()
+            elapsed = now - self._last_time if self._last_time is not None else 0.0
+            steps = step - self._last_step
+            tokens = state.num_input_tokens_seen - self._last_tokens
+            step_time = elapsed / steps if steps > 0 else None
+            tokens_per_sec = tokens / elapsed if elapsed > 0 and tokens > 0 else None
+            self._last_time, self._last_step, self._last_tokens = now, step, state.num_input_tokens_seen
+            
+            self.metrics_logger.log_metrics(epoch, step, loss, grad_norm, lr, step_time, tokens_per_sec)
             if step % 10 == 0:
-                print(f"Step {step} | Loss: {loss:.4f} | GN: {grad_norm:.4f} | Epoch: {epoch:.2f}")
+                throughput = f" | {tokens_per_sec:.0f} tok/s" if tokens_per_sec else ""
+                print(f"Step {step} | Loss: {loss:.4f} | GN: {grad_norm:.4f} | Epoch: {epoch:.2f}{throughput}")
     
-    def _compute_grad_norm(self) -> float:
-        """計算模型梯度的 L2 範數"""
-        total_norm = 0.0
-        for p in self.model.parameters():
-            if p.grad is not None:
-                total_norm += p.grad.data.norm(2).item() ** 2
-        total_norm = total_norm ** 0.5
-        return total_norm
+    def on_train_end(self, args, state, control, **kwargs):
+        self.metrics_logger.close()
+
+
+# -------------------------------------------------------
+# 吞吐量分析 Callback（寫入 training_profile.csv）
+# -------------------------------------------------------
+PROFILE_FIELDS = [
+    'step', 'real_tokens_per_sec', 'padding_fraction',
+    'dataloader_time', 'compute_time', 'dataloader_fraction', 'peak_memory_mb', 'timestamp',
+]
+
+
+class ProfilingCallback(TrainerCallback):
+    """
+    每個 logging 區間記錄：非補齊 token 的吞吐量、補齊比例、
+    等待資料與前向/反向計算的時間分配，以及峰值記憶體
+
+    Trainer 在 on_step_begin 之前就取好整個梯度累積所需的 batch，
+    因此「上一步結束 → 這一步開始」即為資料載入時間，「開始 → 結束」為計算時間。
+    """
+    
+    def __init__(self, profile_logger: MetricsLogger, collator):
+        self.profile_logger = profile_logger
+        self.collator = collator
+        self._use_cuda = torch.cuda.is_available()
+        self._reset(time.perf_counter())
+    
+    def _reset(self, now: float):
+        self._interval_start = now
+        self._last_step_end = now
+        self._step_begin = None
+        self._dataloader_time = 0.0
+        self._compute_time = 0.0
+        if self._use_cuda:
+            torch.cuda.reset_peak_memory_stats()
+    
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.collator.pop_token_counts()
+        self._reset(time.perf_counter())
+    
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._step_begin = time.perf_counter()
+        self._dataloader_time += self._step_begin - self._last_step_end
+    
+    def on_step_end(self, args, state, control, **kwargs):
+        if self._use_cuda:
+            # 等待 GPU 完成，計算時間才不會被算到下一步的資料載入
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        if self._step_begin is not None:
+            self._compute_time += now - self._step_begin
+        self._last_step_end = now
+    
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if not logs or 'loss' not in logs:
+            return
+        now = time.perf_counter()
+        elapsed = now - self._interval_start
+        real_tokens, total_tokens = self.collator.pop_token_counts()
+        measured = self._dataloader_time + self._compute_time
+        peak_memory_mb = torch.cuda.max_memory_allocated() / 1024 ** 2 if self._use_cuda else None
+        
+        self.profile_logger.log_record({
+            'step': state.global_step,
+            'real_tokens_per_sec': real_tokens / elapsed if elapsed > 0 else None,
+            'padding_fraction': 1 - real_tokens / total_tokens if total_tokens else None,
+            'dataloader_time': self._dataloader_time,
+            'compute_time': self._compute_time,
+            'dataloader_fraction': self._dataloader_time / measured if measured > 0 else None,
+            'peak_memory_mb': peak_memory_mb,
+        })
+        self._reset(now)
+    
+    def on_evaluate(self, args, state, control, **kwargs):
+        # 評估的 batch 也經過 collator，且評估時間不是資料載入，捨棄這段區間重新計算
+        self.collator.pop_token_counts()
+        self._reset(time.perf_counter())
+    
+    def on_train_end(self, args, state, control, **kwargs):
+        self.profile_logger.close()
+
+
+# -------------------------------------------------------
+# 訓練中評估：held-out loss / perplexity + test_cases_200 抽樣生成
+# -------------------------------------------------------
+EVAL_FIELDS = ['step', 'eval_loss', 'perplexity', 'timestamp']
+EVAL_MAX_NEW_TOKENS = 256
+EVAL_GENERATION_BATCH = 8
+
+
+class EvalGenerationCallback(TrainerCallback):
+    """
+    每次 Trainer 評估（held-out loss）後，記錄 perplexity，
+    並以目前的 LoRA 批次生成抽樣測試題的回答，寫入 eval_samples.jsonl
+    """
+    
+    def __init__(self, eval_logger: MetricsLogger, tokenizer, test_cases: List[Dict], samples_file: str):
+        self.eval_logger = eval_logger
+        self.tokenizer = tokenizer
+        self.test_cases = test_cases
+        self.samples_file = samples_file
+        self.prompts = [qwen_generation_prompt(case["input"]) for case in test_cases]
+    
+    def on_evaluate(self, args, state, control, model=None, metrics=None, **kwargs):
+        eval_loss = (metrics or {}).get('eval_loss')
+        if eval_loss is None:
+            return
+        perplexity = math.exp(eval_loss) if eval_loss < 50 else float('inf')
+        self.eval_logger.log_record({'step': state.global_step, 'eval_loss': eval_loss, 'perplexity': perplexity})
+        print(f"[評估] Step {state.global_step} | Eval Loss: {eval_loss:.4f} | Perplexity: {perplexity:.2f}")
+        
+        if self.prompts and model is not None:
+            answers = self._generate(model)
+            with open(self.samples_file, 'a', encoding='utf-8') as f:
+                for case, answer in zip(self.test_cases, answers):
+                    record = {'step': state.global_step, 'name': case.get('name', ''), 'input': case['input'], 'output': answer}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            print(f"[評估] 已生成 {len(answers)} 題抽樣回答：{self.samples_file}")
+    
+    def _generate(self, model) -> List[str]:
+        was_training = model.training
+        padding_side = self.tokenizer.padding_side
+        model.eval()
+        # 批次生成需要左側補齊；collator 已在建立時記下訓練用的補齊方向
+        self.tokenizer.padding_side = "left"
+        try:
+            answers = []
+            for start in range(0, len(self.prompts), EVAL_GENERATION_BATCH):
+                answers.extend(generate_reply_batch(
+                    self.tokenizer, model, self.prompts[start:start + EVAL_GENERATION_BATCH],
+                    max_new_tokens=EVAL_MAX_NEW_TOKENS, do_sample=False, use_cache=True,
+                ))
+            return answers
+        finally:
+            self.tokenizer.padding_side = padding_side
+            if was_training:
+                model.train()
+    
+    def on_train_end(self, args, state, control, **kwargs):
+        self.eval_logger.close()
+
+
+# -------------------------------------------------------
+# 背景寫入 LoRA checkpoint 的 Trainer
+# -------------------------------------------------------
+class AsyncCheckpointTrainer(Trainer):
+    """
+    儲存 checkpoint 時只在主執行緒複製 LoRA 權重到 CPU，
+    寫檔交給背景執行緒，訓練不必等待磁碟 I/O
+
+    optimizer / scheduler / trainer_state 仍由 Trainer 同步寫入（續訓需要）。
+    權重先寫入暫存檔再改名，中斷時 checkpoint 只會缺檔而不會留下半份權重，
+    find_latest_checkpoint 會略過這類不完整的 checkpoint。
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._save_thread = None
+        self._save_error = None
+    
+    def save_model(self, output_dir: str = None, _internal_call: bool = False):
+        output_dir = output_dir or self.args.output_dir
+        if not self.args.should_save:
+            return
+        self.save_adapter_async(output_dir)
+        if not _internal_call:
+            # 外部直接呼叫時維持同步語意
+            self.wait_for_checkpoint()
+    
+    def save_adapter_async(self, output_dir: str):
+        """複製 LoRA 權重到 CPU 後於背景寫入 output_dir"""
+        # 同一時間只寫一份，避免多份快照同時佔用記憶體
+        self.wait_for_checkpoint()
+        model = self.accelerator.unwrap_model(self.model)
+        adapter_name = model.active_adapter
+        snapshot = {
+            name: param.detach().to("cpu", copy=True).contiguous()
+            for name, param in model.named_parameters()
+            if "lora_" in name
+        }
+        state_dict = get_peft_model_state_dict(model, state_dict=snapshot, adapter_name=adapter_name)
+        
+        os.makedirs(output_dir, exist_ok=True)
+        peft_config = copy.deepcopy(model.peft_config[adapter_name])
+        peft_config.inference_mode = True
+        peft_config.save_pretrained(output_dir)
+        
+        self._save_thread = threading.Thread(
+            target=self._write_adapter, args=(state_dict, output_dir), name="checkpoint-writer"
+        )
+        self._save_thread.start()
+    
+    def _write_adapter(self, state_dict: Dict, output_dir: str):
+        path = os.path.join(output_dir, SAFETENSORS_WEIGHTS_NAME)
+        tmp_path = f"{path}.tmp"
+        try:
+            save_file(state_dict, tmp_path, metadata={"format": "pt"})
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self._save_error = e
+    
+    def wait_for_checkpoint(self):
+        """等待背景寫入完成；寫入失敗時在主執行緒拋出例外"""
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+        if self._save_error is not None:
+            error, self._save_error = self._save_error, None
+            raise RuntimeError(f"LoRA checkpoint 寫入失敗：{error}") from error
+
+
+def find_latest_checkpoint(output_dir: str):
+    """回傳 output_dir 下步數最大且完整（含權重與 trainer_state）的 checkpoint-*，沒有則回傳 None"""
+    if not os.path.isdir(output_dir):
+        return None
+    checkpoints = []
+    for path in Path(output_dir).glob(f"{PREFIX_CHECKPOINT_DIR}-*"):
+        step = path.name.rsplit("-", 1)[-1]
+        if not (path.is_dir() and step.isdigit()):
+            continue
+        if (path / SAFETENSORS_WEIGHTS_NAME).exists() and (path / "trainer_state.json").exists():
+            checkpoints.append((int(step), path))
+        else:
+            print(f"[WARN] 略過不完整的 checkpoint：{path}")
+    return str(max(checkpoints)[1]) if checkpoints else None
 
 
 # -------------------------------------------------------
@@ -147,6 +454,28 @@ parser.add_argument('--dataset_file', type=str, default=None,
                     help='訓練集檔案完整路徑（若指定則覆蓋預設 behavior_dataset.jsonl）')
 parser.add_argument('--output_dir', type=str, default=None,
                     help='輸出目錄（若指定則覆蓋預設值）')
+parser.add_argument('--batch_size', type=int, default=1,
+                    help='每個裝置的 batch 大小，預設為 1；梯度累積步數會自動調整，維持有效 batch 為 8')
+parser.add_argument('--metrics_parquet', action='store_true',
+                    help='訓練結束時另存 training_metrics.parquet（需要 pandas + pyarrow）')
+parser.add_argument('--pack', action='store_true',
+                    help='序列打包：把多筆短樣本串接成一條最長 1024 token 的序列（各樣本的注意力與 label mask 互不影響）')
+parser.add_argument('--resume_from_checkpoint', type=str, default=None,
+                    help='從 checkpoint 續訓：auto 表示自動使用輸出目錄下最新的 checkpoint-*，或指定 checkpoint 路徑')
+parser.add_argument('--save_steps', type=int, default=500,
+                    help='每隔幾步儲存一次 checkpoint（LoRA 權重於背景寫入），預設為 500')
+parser.add_argument('--incremental_from', type=str, default=None,
+                    help='增量訓練：從指定舊版本（如 v3）的 LoRA 繼續，只訓練新增樣本 + 部分舊樣本回放')
+parser.add_argument('--init_adapter', type=str, default=None,
+                    help='增量訓練的起始 LoRA 路徑（若不指定則使用 lora_output 下舊版本的預設輸出目錄）')
+parser.add_argument('--replay_ratio', type=float, default=0.3,
+                    help='增量訓練時回放的舊樣本數相對於新增樣本數的比例，預設為 0.3')
+parser.add_argument('--eval_steps', type=int, default=0,
+                    help='每隔幾步進行訓練中評估（held-out loss/perplexity + 抽樣生成），預設 0 表示不評估')
+parser.add_argument('--eval_fraction', type=float, default=0.05,
+                    help='從訓練集保留作為評估用的比例（不參與訓練），預設為 0.05')
+parser.add_argument('--eval_samples', type=int, default=8,
+                    help='每次評估從 test_cases_200.jsonl 抽樣生成的題數，預設為 8（0 表示只計算 loss）')
 args = parser.parse_args()
 
 TRAIN_LANGUAGE = args.lang
@@ -185,15 +514,36 @@ else:
     DATASET_PATH = str(parent_dir / "datasets" / "behavior" / TRAIN_LANGUAGE / DATASET_VERSION / "behavior_dataset.jsonl")
     print(f"[檔案] 使用預設訓練集檔案：{DATASET_PATH}")
 
+def default_output_dir(version: str) -> str:
+    """lora_output/<模型>/<語言>/<版本>/qwen25_behavior_<版本>"""
+    # 將版本號轉換（v4 → v4, v4.3 → v4.3）
+    version_name = version if version.startswith('v') else f"v{version}"
+    # 從基礎模型路徑提取模型名稱
+    model_name = os.path.basename(BASE_MODEL)
+    return str(parent_dir / "lora_output" / model_name / TRAIN_LANGUAGE / version_name / f"qwen25_behavior_{version_name}")
+
+
 # 輸出路徑（若命令列指定則使用，否則用預設）
 if args.output_dir:
     OUTPUT_DIR = args.output_dir
 else:
-    # 將版本號轉換（v4 → v4, v4.3 → v4.3）
-    version_name = DATASET_VERSION if DATASET_VERSION.startswith('v') else f"v{DATASET_VERSION}"
-    # 從基礎模型路徑提取模型名稱
-    model_name = os.path.basename(BASE_MODEL)
-    OUTPUT_DIR = str(parent_dir / "lora_output" / model_name / TRAIN_LANGUAGE / version_name / f"qwen25_behavior_{version_name}")
+    OUTPUT_DIR = default_output_dir(DATASET_VERSION)
+
+# 增量訓練：舊版本的訓練集與 LoRA
+INIT_ADAPTER = None
+PREVIOUS_DATASET_PATH = None
+if args.incremental_from:
+    PREVIOUS_DATASET_PATH = str(parent_dir / "datasets" / "behavior" / TRAIN_LANGUAGE / args.incremental_from / "behavior_dataset.jsonl")
+    INIT_ADAPTER = args.init_adapter or default_output_dir(args.incremental_from)
+    print(f"[增量] 舊版本訓練集：{PREVIOUS_DATASET_PATH}")
+    print(f"[增量] 起始 LoRA：{INIT_ADAPTER}")
+    for path in (PREVIOUS_DATASET_PATH, os.path.join(INIT_ADAPTER, "adapter_config.json")):
+        if not os.path.exists(path):
+            print(f"[ERROR] 增量訓練所需檔案不存在：{path}")
+            exit(1)
+
+# 訓練中評估的抽樣測試題
+EVAL_TEST_CASES_PATH = str(parent_dir / "datasets" / "test" / TRAIN_LANGUAGE / "test_cases_200.jsonl")
 
 print(f"[路徑] 訓練集路徑：{DATASET_PATH}")
 print(f"[路徑] 輸出路徑：{OUTPUT_DIR}\n")
@@ -226,55 +576,200 @@ def qwen_chat_template(instruction: str, user_input: str, assistant_output: str)
     return final_prompt
 
 
+def assistant_span_start(prompt: str, assistant_output: str) -> int:
+    """assistant 回覆內容在 prompt 中的起始字元位置（緊接在 <|im_start|>assistant\n 之後）"""
+    return len(prompt) - len(assistant_output.strip() + "\n<|im_end|>\n")
+
+
+def qwen_generation_prompt(user_input: str) -> str:
+    """與訓練相同格式的生成用 prompt（結尾停在 <|im_start|>assistant\n）"""
+    prompt = qwen_chat_template("", user_input, "")
+    return prompt[:assistant_span_start(prompt, "")]
+
+
+# 單筆樣本的最大 token 數（超過則截斷）
+MAX_LENGTH = 1024
+
+
 # -------------------------------------------------------
-# Dataset（含 label masking）
+# 前處理：tokenize + label 起始位置（結果寫入 token 快取，只需執行一次）
+# -------------------------------------------------------
+def encode_examples(examples: List[Dict], tokenizer) -> List[tuple]:
+    """
+    將一批樣本轉為 (input_ids, label_start)
+
+    label_start 之前（system / user 以及 assistant 起始標記）的 token 在訓練時會被 mask 成 -100，
+    只對 assistant 回覆內容與結尾的 <|im_end|> 計算 loss。
+    label_start 由字元位置經 offset mapping 換算成 token 位置。
+    """
+    prompts = [
+        qwen_chat_template(ex["instruction"], ex["input"], ex["output"])
+        for ex in examples
+    ]
+    span_starts = [assistant_span_start(p, ex["output"]) for p, ex in zip(prompts, examples)]
+
+    if not tokenizer.is_fast:
+        # slow tokenizer 沒有 offset mapping，改以前半段的 token 數作為起點
+        tokenized = tokenizer(prompts, truncation=True, max_length=MAX_LENGTH)
+        return [
+            (input_ids, min(len(input_ids), len(tokenizer(p[:c])["input_ids"])))
+            for input_ids, p, c in zip(tokenized["input_ids"], prompts, span_starts)
+        ]
+
+    tokenized = tokenizer(prompts, truncation=True, max_length=MAX_LENGTH, return_offsets_mapping=True)
+    encoded = []
+    for input_ids, offsets, span_start in zip(tokenized["input_ids"], tokenized["offset_mapping"], span_starts):
+        # 第一個結尾超過回覆起點的 token；回覆被截斷掉時全部 mask
+        start = next((i for i, (_, end) in enumerate(offsets) if end > span_start), len(input_ids))
+        encoded.append((input_ids, start))
+    return encoded
+
+
+# 影響 tokenize 結果的設定，納入 token 快取鍵（修改後會自動重建快取）
+PREPROCESS_CONFIG = {
+    "system_prompt": SYSTEM_PROMPT,
+    "max_length": MAX_LENGTH,
+    "label_mask": "assistant_span_offsets",
+}
+
+
+# -------------------------------------------------------
+# Dataset（含 label masking，讀取預先 tokenize 的快取）
 # -------------------------------------------------------
 @dataclass
 class SFTDataset:
-    data: List[Dict]
-    tokenizer: AutoTokenizer
+    cache: TokenCache
+    indices: np.ndarray = None   # 只使用部分樣本（增量訓練），None 表示全部
 
     def __len__(self):
-        return len(self.data)
-
-    def __getitem__(self, idx):
-        ex = self.data[idx]
-
-        prompt = qwen_chat_template(
-            ex["instruction"],
-            ex["input"],
-            ex["output"]
-        )
+        return len(self.cache) if self.indices is None else len(self.indices)
 
-        # --- tokenize ---
-        tokenized = self.tokenizer(
-            prompt,
-            truncation=True,
-            max_length=1024,
-            padding="max_length",
-            return_tensors="pt",
-        )
+    def lengths(self) -> np.ndarray:
+        """每筆樣本的 token 數"""
+        lengths = self.cache.lengths()
+        return lengths if self.indices is None else lengths[self.indices]
 
-        input_ids = tokenized["input_ids"][0]
-        attention_mask = tokenized["attention_mask"][0]
+    def __getitem__(self, idx):
+        if self.indices is not None:
+            idx = int(self.indices[idx])
+        ids, start = self.cache.get(idx)
+        input_ids = torch.from_numpy(np.asarray(ids, dtype=np.int64))
 
         # --- 建立 labels ---
         labels = input_ids.clone()
 
-        # 將 <|im_start|>assistant 之前全部 mask (-100)
-        assistant_token_id = self.tokenizer.encode("<|im_start|>assistant")[0]
+        # mask（user/system）部分
+        labels[:start] = -100
+
+        # 不補齊，由 SFTDataCollator 依每個 batch 的最長樣本補齊
+        return {
+            "input_ids": input_ids,
+            "labels": labels,
+        }
 
-        # 找到 assistant 的起始位置
-        positions = (input_ids == assistant_token_id).nonzero(as_tuple=True)[0]
 
-        if len(positions) > 0:
-            start = positions[0]
+# -------------------------------------------------------
+# 序列打包（--pack）
+# -------------------------------------------------------
+def pack_examples(lengths, max_length: int = MAX_LENGTH) -> List[List[int]]:
+    """以 first-fit decreasing 將樣本分組，每組總長度不超過 max_length"""
+    order = sorted(range(len(lengths)), key=lambda i: -int(lengths[i]))
+    bins, free = [], []
+    for i in order:
+        n = int(lengths[i])
+        for b in range(len(bins)):
+            if n <= free[b]:
+                bins[b].append(i)
+                free[b] -= n
+                break
         else:
-            start = 0  # 萬一找不到，保底不訓練
+            bins.append([i])
+            free.append(max_length - n)
+    return bins
 
-        # mask（user/system）部分
-        labels[:start] = -100
 
+@dataclass
+class PackedSFTDataset:
+    """
+    每個項目由多筆樣本串接而成
+
+    position_ids 在每筆樣本開頭歸零；不傳 attention_mask 時，transformers 會依
+    position_ids 建立分段的 causal mask，樣本之間不會互相注意。
+    """
+    dataset: SFTDataset
+    bins: List[List[int]]
+
+    def __len__(self):
+        return len(self.bins)
+
+    def __getitem__(self, idx):
+        items = [self.dataset[i] for i in self.bins[idx]]
+        labels = []
+        for item in items:
+            item_labels = item["labels"].clone()
+            # 每筆樣本的第一個 token 不以前一筆樣本的結尾來預測
+            item_labels[0] = -100
+            labels.append(item_labels)
+        return {
+            "input_ids": torch.cat([item["input_ids"] for item in items]),
+            "labels": torch.cat(labels),
+            "position_ids": torch.cat([torch.arange(len(item["input_ids"])) for item in items]),
+        }
+
+
+# -------------------------------------------------------
+# 動態補齊：每個 batch 只補齊到該 batch 最長的樣本
+# -------------------------------------------------------
+@dataclass
+class SFTDataCollator:
+    pad_token_id: int
+    padding_side: str = "right"
+    pad_to_multiple_of: int = 8   # 對齊 8 的倍數，較適合 GPU 矩陣運算
+    # 累計的實際 token 數與補齊後總數（供 ProfilingCallback 計算補齊比例）
+    real_tokens: int = field(default=0, repr=False)
+    total_tokens: int = field(default=0, repr=False)
+
+    def pop_token_counts(self):
+        """取出並歸零累計的 (實際 token 數, 補齊後總數)"""
+        counts = (self.real_tokens, self.total_tokens)
+        self.real_tokens = self.total_tokens = 0
+        return counts
+
+    def __call__(self, features: List[Dict]) -> Dict[str, torch.Tensor]:
+        max_len = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            max_len = -(-max_len // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        batch_size = len(features)
+        self.real_tokens += sum(len(f["input_ids"]) for f in features)
+        self.total_tokens += batch_size * max_len
+        input_ids = torch.full((batch_size, max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((batch_size, max_len), dtype=torch.long)
+        # 補齊位置不計入 loss
+        labels = torch.full((batch_size, max_len), -100, dtype=torch.long)
+
+        packed = "position_ids" in features[0]
+        # 打包模式：補齊的部分也從 0 開始編號，自成一段，不影響實際樣本
+        position_ids = torch.arange(max_len).repeat(batch_size, 1) if packed else None
+
+        for i, f in enumerate(features):
+            n = len(f["input_ids"])
+            sl = slice(max_len - n, max_len) if self.padding_side == "left" else slice(0, n)
+            input_ids[i, sl] = f["input_ids"]
+            attention_mask[i, sl] = 1
+            labels[i, sl] = f["labels"]
+            if packed:
+                position_ids[i, sl] = f["position_ids"]
+                pad_sl = slice(0, max_len - n) if self.padding_side == "left" else slice(n, max_len)
+                position_ids[i, pad_sl] = torch.arange(max_len - n)
+
+        if packed:
+            # 不傳 attention_mask，讓模型依 position_ids 建立分段 mask
+            return {
+                "input_ids": input_ids,
+                "position_ids": position_ids,
+                "labels": labels,
+            }
         return {
             "input_ids": input_ids,
             "attention_mask": attention_mask,
@@ -285,13 +780,60 @@ class SFTDataset:
 # -------------------------------------------------------
 # 主程式
 # -------------------------------------------------------
+def split_eval_dataset(dataset: SFTDataset, fraction: float):
+    """隨機保留部分樣本作為評估集（至少 1 筆），回傳 (訓練集, 評估集)"""
+    indices = dataset.indices if dataset.indices is not None else np.arange(len(dataset.cache))
+    rng = np.random.default_rng(42)
+    shuffled = rng.permutation(indices)
+    n_eval = min(len(indices) - 1, max(1, round(len(indices) * fraction)))
+    return (
+        SFTDataset(dataset.cache, np.sort(shuffled[n_eval:])),
+        SFTDataset(dataset.cache, np.sort(shuffled[:n_eval])),
+    )
+
+
+def sample_eval_test_cases(n: int) -> List[Dict]:
+    """從 test_cases_200.jsonl 固定抽樣 n 題（每次評估使用相同題目，方便比較）"""
+    if n <= 0:
+        return []
+    if not os.path.exists(EVAL_TEST_CASES_PATH):
+        print(f"[WARN] 找不到測試題：{EVAL_TEST_CASES_PATH}，評估時只計算 loss")
+        return []
+    with open(EVAL_TEST_CASES_PATH, 'r', encoding='utf-8-sig') as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    rng = np.random.default_rng(42)
+    picked = rng.choice(len(cases), size=min(n, len(cases)), replace=False)
+    return [cases[i] for i in sorted(picked)]
+
+
+def select_incremental_indices(records: list):
+    """
+    增量訓練的樣本：相對於舊版本新增的樣本 + 隨機回放部分舊樣本（避免遺忘）
+
+    Returns:
+        排序後的樣本索引；沒有新增樣本時回傳 None
+    """
+    new_indices, old_indices = dataset_delta(records, read_jsonl(PREVIOUS_DATASET_PATH))
+    print(f"[增量] 相對於 {args.incremental_from}：新增 {len(new_indices)} 筆，沿用 {len(old_indices)} 筆")
+    if not new_indices:
+        print("[增量] 沒有新增樣本，不需要訓練")
+        return None
+
+    replay_count = min(len(old_indices), round(len(new_indices) * max(0.0, args.replay_ratio)))
+    rng = np.random.default_rng(42)
+    replay = rng.choice(old_indices, size=replay_count, replace=False) if replay_count else []
+    print(f"[增量] 回放舊樣本 {replay_count} 筆，本次訓練共 {len(new_indices) + replay_count} 筆")
+    return np.sort(np.concatenate([np.asarray(new_indices), np.asarray(replay, dtype=np.int64)]))
+
+
 def main():
     print("=" * 60)
     print(" 第一步：驗證資料集")
     print("=" * 60)
     
-    # 驗證 JSONL 格式
-    is_valid, validation_message = validate_jsonl(DATASET_PATH)
+    # 驗證 JSONL 格式（同時解析；資料集雜湊也用於 token 快取鍵）
+    dataset_hash = calc_sha256(DATASET_PATH)
+    is_valid, validation_message, dataset_records = validate_jsonl(DATASET_PATH, dataset_hash)
     print(validation_message)
     
     if not is_valid:
@@ -331,34 +873,69 @@ def main():
         task_type="CAUSAL_LM",
     )
 
-    model = get_peft_model(model, lora_config)
+    if INIT_ADAPTER:
+        # 增量訓練：沿用舊版本 LoRA 的權重與設定
+        print(f"[增量] 載入舊版本 LoRA：{INIT_ADAPTER}")
+        model = PeftModel.from_pretrained(model, INIT_ADAPTER, is_trainable=True)
+    else:
+        model = get_peft_model(model, lora_config)
     model.print_trainable_parameters()
 
-    # --- Dataset ---
-    dataset_raw = []
-    with open(DATASET_PATH, "r", encoding="utf-8-sig") as f:
-        for line in f:
-            if not line.strip():
-                continue
-            dataset_raw.append(json.loads(line))
-
-
-    train_dataset = SFTDataset(dataset_raw, tokenizer)
+    # --- Dataset（以資料集雜湊 + tokenizer 雜湊為鍵的 token 快取，只在第一次 tokenize）---
+    token_cache = load_or_build_token_cache(
+        DATASET_PATH,
+        tokenizer,
+        lambda examples: encode_examples(examples, tokenizer),
+        PREPROCESS_CONFIG,
+        records=dataset_records,
+        dataset_hash=dataset_hash,
+    )
+    train_dataset = SFTDataset(token_cache)
     print(f"[檔案] 資料集載入共 {len(train_dataset)} 筆")
+    if PREVIOUS_DATASET_PATH:
+        indices = select_incremental_indices(dataset_records or read_jsonl(DATASET_PATH))
+        if indices is None:
+            return
+        train_dataset = SFTDataset(token_cache, indices)
+    eval_dataset = None
+    if args.eval_steps > 0:
+        train_dataset, eval_dataset = split_eval_dataset(train_dataset, args.eval_fraction)
+        print(f"[評估] 保留 {len(eval_dataset)} 筆作為評估集，每 {args.eval_steps} 步評估一次")
+    if args.pack:
+        bins = pack_examples(train_dataset.lengths())
+        print(f"[打包] {len(train_dataset)} 筆樣本打包為 {len(bins)} 條序列（每條最長 {MAX_LENGTH} token）")
+        train_dataset = PackedSFTDataset(train_dataset, bins)
+        # 分段 mask 只在沒有 past_key_values 時啟用，訓練時不需要 KV cache
+        model.config.use_cache = False
+    data_collator = SFTDataCollator(tokenizer.pad_token_id, tokenizer.padding_side)
+
+    # 維持有效 batch（batch_size × 梯度累積）為 8
+    batch_size = max(1, args.batch_size)
+    grad_accum = max(1, 8 // batch_size)
 
     # --- Training Args ---
     training_args = TrainingArguments(
         output_dir=OUTPUT_DIR,
-        per_device_train_batch_size=1,
-        gradient_accumulation_steps=8,
+        per_device_train_batch_size=batch_size,
+        gradient_accumulation_steps=grad_accum,
+        # 依長度分組抽樣，讓同一個 batch 的樣本長度相近，減少補齊（打包後長度已接近，不需要）
+        group_by_length=not args.pack,
         num_train_epochs=1,
         logging_steps=5,
+        save_steps=args.save_steps,
         save_total_limit=2,
         learning_rate=2e-4,
         bf16=True,
         warmup_ratio=0.05,
         optim="paged_adamw_8bit",
         lr_scheduler_type="cosine",
+        # 統計輸入 token 數，供 MetricsCallback 計算 tokens/sec
+        include_num_input_tokens_seen=True,
+        # 訓練中評估：只需要 loss，不保留 logits（避免佔用大量記憶體）
+        eval_strategy="steps" if eval_dataset is not None else "no",
+        eval_steps=args.eval_steps if eval_dataset is not None else None,
+        per_device_eval_batch_size=batch_size,
+        prediction_loss_only=True,
     )
 
     print("[開始] 開始訓練（含 Chat 模板 + Label Masking）...")
@@ -369,24 +946,76 @@ def main():
     # 自訂 Callback 來記錄訓練指標
     metrics_callback = MetricsCallback(metrics_logger, model)
     
-    trainer = Trainer(
+    # 吞吐量分析：與 training_metrics.csv 同目錄輸出 training_profile.csv
+    profile_logger = MetricsLogger(OUTPUT_DIR, name="training_profile", fields=PROFILE_FIELDS)
+    profiling_callback = ProfilingCallback(profile_logger, data_collator)
+    callbacks = [metrics_callback, profiling_callback]
+    
+    # 訓練中評估：loss/perplexity 寫入 training_eval.csv，抽樣回答寫入 eval_samples.jsonl
+    eval_logger = None
+    if eval_dataset is not None:
+        eval_logger = MetricsLogger(OUTPUT_DIR, name="training_eval", fields=EVAL_FIELDS)
+        samples_file = os.path.join(OUTPUT_DIR, "eval_samples.jsonl")
+        if not args.resume_from_checkpoint and os.path.exists(samples_file):
+            os.remove(samples_file)
+        # 放在最前面：生成完成後其他 callback 才重新起算吞吐量
+        callbacks.insert(0, EvalGenerationCallback(
+            eval_logger, tokenizer, sample_eval_test_cases(args.eval_samples), samples_file
+        ))
+    
+    trainer = AsyncCheckpointTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
+        eval_dataset=eval_dataset,
+        data_collator=data_collator,
         tokenizer=tokenizer,
-        callbacks=[metrics_callback],
+        callbacks=callbacks,
     )
 
-    trainer.train()
+    # 續訓：auto 時找輸出目錄下最新的完整 checkpoint
+    resume_checkpoint = args.resume_from_checkpoint
+    if resume_checkpoint == "auto":
+        resume_checkpoint = find_latest_checkpoint(OUTPUT_DIR)
+        if resume_checkpoint is None:
+            print(f"[續訓] {OUTPUT_DIR} 下沒有可用的 checkpoint，從頭開始訓練")
+    elif resume_checkpoint and not os.path.isdir(resume_checkpoint):
+        print(f"[ERROR] checkpoint 不存在：{resume_checkpoint}")
+        exit(1)
+    if resume_checkpoint:
+        print(f"[續訓] 從 checkpoint 續訓：{resume_checkpoint}")
+
+    try:
+        trainer.train(resume_from_checkpoint=resume_checkpoint)
+    finally:
+        # 訓練中斷時也要寫出已記錄的指標，並等待進行中的 checkpoint 寫完
+        metrics_logger.close()
+        profile_logger.close()
+        if eval_logger is not None:
+            eval_logger.close()
+        trainer.wait_for_checkpoint()
 
     print("[保存] 儲存 LoRA...")
-    model.save_pretrained(OUTPUT_DIR)
+    trainer.save_adapter_async(OUTPUT_DIR)
     
-    # 保存訓練指標
-    metrics_logger.save_json()
+    # 保存訓練指標（與 LoRA 寫檔同時進行）
+    parquet_saved = metrics_logger.save_json(parquet=args.metrics_parquet)
+    profile_logger.save_json()
+    if eval_logger is not None:
+        eval_logger.save_json()
+    trainer.wait_for_checkpoint()
     
     print(" 訓練完成！")
     print(f"[統計] 訓練指標已保存到:")
     print(f"   - CSV: {metrics_logger.metrics_file}")
+    print(f"   - JSON: {metrics_logger.json_file}")
+    if args.metrics_parquet and parquet_saved:
+        print(f"   - Parquet: {metrics_logger.parquet_file}")
+    print(f"[統計] 吞吐量分析（實際 token/秒、補齊比例、資料載入/計算時間、峰值記憶體）:")
+    print(f"   - CSV: {profile_logger.metrics_file}")
+    if eval_logger is not None:
+        print(f"[統計] 訓練中評估（held-out loss / perplexity 與抽樣回答）:")
+        print(f"   - CSV: {eval_logger.metrics_file}")
+        print(f"   - 回答: {os.path.join(OUTPUT_DIR, 'eval_samples.jsonl')}")
 if __name__ == "__main__":
     main()
@@ -4,6 +4,7 @@ import os
 import sys
 import threading
 from pathlib import Path
+from contextlib import closing
 from datetime import datetime
 import json
 import hashlib
@@ -11,7 +12,8 @@ import time
 
 # 導入模型工具函數
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from model_utils import load_chat_model, chat_ask, format_qwen_single_turn
+from model_utils import AdapterPool, format_qwen_single_turn, ChatSession
+from results_store import ResultsStore, LANGUAGES as RESULT_LANGUAGES
 
 # ==============================
 # 多語言配置 - 從獨立 JSON 檔案載入
@@ -269,20 +271,23 @@ print(f"🖥️ {get_text('debug_models_dir')} {MODELS_DIR}")
 print(f"🖥️ {get_text('debug_models_exist')} {MODELS_DIR.exists()}")
 
 # ==============================
-# Chat 模型載入（使用 Streamlit cache 包裝）
+# Chat 模型載入（每個基礎模型一個 AdapterPool，以 Streamlit cache 常駐）
 # ==============================
 @st.cache_resource
+def _get_adapter_pool(base_model_path):
+    """每個基礎模型只載入一次；切換 LoRA 由 AdapterPool 以 set_adapter 完成"""
+    print(f"[UI] Loading model from: {base_model_path}")
+    return AdapterPool(base_model_path)
+
+
 def _load_chat_model_cached(base_model_path, lora_path):
-    """包裝 load_chat_model 供 Streamlit cache 使用"""
+    """取得 (tokenizer, model)：基礎模型常駐，LoRA 依需要載入或切換"""
     try:
-        print(f"[UI] Loading model from: {base_model_path}")
+        pool = _get_adapter_pool(base_model_path)
         if lora_path:
             print(f"[UI] With LoRA: {lora_path}")
-        tokenizer, model = load_chat_model(base_model_path, lora_path)
-        if tokenizer is None or model is None:
-            print(f"[UI] Model loading returned None")
-            return None, None
-        print(f"[UI] Model loaded successfully")
+        tokenizer, model = pool.activate(lora_path)
+        print(f"[UI] Model ready ({pool.describe()})")
         return tokenizer, model
     except Exception as e:
         print(f"[UI] Error loading model: {str(e)}")
@@ -587,18 +592,24 @@ if "chat_tokenizer" not in st.session_state:
     st.session_state.chat_tokenizer = None
 if "chat_model" not in st.session_state:
     st.session_state.chat_model = None
+# 目前 session 使用的基礎模型與 LoRA（AdapterPool 為所有 session 共用，生成前依此切換）
+if "chat_model_paths" not in st.session_state:
+    st.session_state.chat_model_paths = None
 if "chat_messages" not in st.session_state:
     st.session_state.chat_messages = []
+if "chat_session" not in st.session_state:
+    st.session_state.chat_session = None
 
 # ==============================
-# Tab 1: 下載 / Tab 2: 訓練 / Tab 3: 測試 / Tab 4: 聊天 / Tab 5: 資料轉換
+# Tab 1: 下載 / Tab 2: 訓練 / Tab 3: 測試 / Tab 4: 聊天 / Tab 5: 資料轉換 / Tab 6: 測試結果
 # ==============================
-tab_download, tab_train, tab_test, tab_chat, tab_convert = st.tabs([
+tab_download, tab_train, tab_test, tab_chat, tab_convert, tab_results = st.tabs([
     f"📥 {get_text('download_title')}",
     f"🎓 {get_text('tab_train')}", 
     f"🧪 {get_text('tab_test')}", 
     f"💬 {get_text('chat_title')}",
-    f"🔄 {get_text('convert_title')}"
+    f"🔄 {get_text('convert_title')}",
+    f"📊 {get_text('results_title')}"
 ])
 
 with tab_train:
@@ -922,11 +933,13 @@ with tab_test:
             
             # 根據選擇決定使用哪個測試腳本
             test_dataset_file = str(DATASETS_DIR / "test" / test_lang / test_dataset)
+            # 多輪測試集需在同一段對話中依序提問
+            multi_turn_flag = " --multi-turn" if "multiple_rounds" in test_dataset else ""
             
             if test_lora == "base":
                 # 使用 Base Model Only 測試
                 test_script = str(SCRIPTS_DIR / "test_base_model.py")
-                command = f"python \"{test_script}\" --lang {test_lang} --model_path \"{base_model_path}\" --test_file \"{test_dataset_file}\""
+                command = f"python \"{test_script}\" --lang {test_lang} --model_path \"{base_model_path}\" --test_file \"{test_dataset_file}\"{multi_turn_flag}"
             else:
                 # 使用 LoRA 測試
                 test_script = str(SCRIPTS_DIR / "test_behavior.py")
@@ -939,7 +952,7 @@ with tab_test:
                         break
                 
                 if lora_path:
-                    command = f"python \"{test_script}\" --lang {test_lang} --model_path \"{base_model_path}\" --lora \"{lora_path}\" --test_file \"{test_dataset_file}\""
+                    command = f"python \"{test_script}\" --lang {test_lang} --model_path \"{base_model_path}\" --lora \"{lora_path}\" --test_file \"{test_dataset_file}\"{multi_turn_flag}"
                 else:
                     st.error(f"無法找到 LoRA 模型: {test_lora}")
                     st.session_state.is_testing = False
@@ -1073,8 +1086,10 @@ with tab_chat:
                     if tokenizer and model:
                         st.session_state.chat_tokenizer = tokenizer
                         st.session_state.chat_model = model
-                        # 清除舊的聊天歷史
+                        st.session_state.chat_model_paths = (base_path, lora_path)
+                        # 清除舊的聊天歷史與多輪對話 session
                         st.session_state.chat_messages = []
+                        st.session_state.chat_session = None
                         st.success(get_text("chat_loaded"))
                     else:
                         st.error(get_text("error_msg"))
@@ -1084,20 +1099,24 @@ with tab_chat:
         st.divider()
         st.subheader(get_text("chat_history"))
         
-        # chat_ask 已經返回干淨的內容，直接使用
+        # ChatSession.ask_stream 串流時已截掉停止標記並去除開頭空白，直接使用
         def clean_response(text):
-            """直接返回文本（chat_ask 已處理過）"""
+            """直接返回文本（ask_stream 已處理過）"""
             return text if text else ""
         
+        def render_chat_bubble(role, content):
+            """產生單則聊天訊息的 HTML（歷史記錄與串流回覆共用）"""
+            content = content.replace("<", "&lt;").replace(">", "&gt;")
+            if role == "user":
+                return f'<div style="margin: 8px 0; text-align: right;"><div style="display: inline-block; background-color: #e3f2fd; padding: 8px 12px; border-radius: 8px; max-width: 70%;"><strong>You:</strong> {content}</div></div>'
+            return f'<div style="margin: 8px 0;"><div style="display: inline-block; background-color: #f5f5f5; padding: 8px 12px; border-radius: 8px; max-width: 70%;"><strong>AI:</strong> {content}</div></div>'
+        
         # 顯示聊天記錄（使用自定義容器，自動滾動到底部）
         chat_html = '<div class="chat-container" id="chat-container">'
         for msg in st.session_state.chat_messages:
             # 清理特殊標記
             content = clean_response(msg["content"])
-            if msg["role"] == "user":
-                chat_html += f'<div style="margin: 8px 0; text-align: right;"><div style="display: inline-block; background-color: #e3f2fd; padding: 8px 12px; border-radius: 8px; max-width: 70%;"><strong>You:</strong> {content.replace("<", "&lt;").replace(">", "&gt;")}</div></div>'
-            else:
-                chat_html += f'<div style="margin: 8px 0;"><div style="display: inline-block; background-color: #f5f5f5; padding: 8px 12px; border-radius: 8px; max-width: 70%;"><strong>AI:</strong> {content.replace("<", "&lt;").replace(">", "&gt;")}</div></div>'
+            chat_html += render_chat_bubble(msg["role"], content)
         chat_html += '</div>'
         
         st.markdown(chat_html, unsafe_allow_html=True)
@@ -1112,6 +1131,9 @@ with tab_chat:
             </script>
         """, unsafe_allow_html=True)
         
+        # 串流回覆顯示區（緊接在聊天記錄下方，只更新本輪對話，不重繪整段歷史）
+        stream_placeholder = st.empty()
+        
         # 初始化聊天提交狀態
         if "chat_submitted" not in st.session_state:
             st.session_state.chat_submitted = False
@@ -1131,23 +1153,43 @@ with tab_chat:
                     # 添加用戶消息
                     st.session_state.chat_messages.append({"role": "user", "content": user_input})
                     
-                    # AI 回覆
-                    with st.spinner(get_text("chat_sending")):
-                        # 確保獲取正確的語言值
-                        chat_lang = st.session_state.get("chat_lang", "zh-TW")
-                        if not chat_lang:
-                            chat_lang = "zh-TW"
+                    # 確保獲取正確的語言值
+                    chat_lang = st.session_state.get("chat_lang", "zh-TW")
+                    if not chat_lang:
+                        chat_lang = "zh-TW"
+                    
+                    # 模型與其他 session 共用：持有 AdapterPool 的鎖並切回本 session 的 LoRA，
+                    # 建立 session（system 前綴 KV）與生成都在鎖內完成
+                    base_path, lora_path = st.session_state.chat_model_paths
+                    with _get_adapter_pool(base_path).use(lora_path):
+                        # 多輪對話 session（保留 KV cache）；切換語言時重新建立
+                        chat_session = st.session_state.chat_session
+                        if chat_session is None or chat_session.lang != chat_lang:
+                            chat_session = ChatSession(
+                                st.session_state.chat_tokenizer,
+                                st.session_state.chat_model,
+                                chat_lang
+                            )
+                            st.session_state.chat_session = chat_session
                         
-                        ai_response = chat_ask(
-                            st.session_state.chat_tokenizer,
-                            st.session_state.chat_model,
-                            user_input,
-                            chat_lang
+                        # AI 回覆（逐段串流顯示，首個 token 出現前顯示思考中）
+                        user_bubble = render_chat_bubble("user", user_input)
+                        stream_placeholder.markdown(
+                            user_bubble + render_chat_bubble("assistant", get_text("chat_sending")),
+                            unsafe_allow_html=True
                         )
-                        st.session_state.chat_messages.append({"role": "assistant", "content": ai_response})
+                        ai_response = ""
+                        # closing：中途中斷時先停止背景 generate，再釋放鎖
+                        with closing(chat_session.ask_stream(user_input)) as stream:
+                            for chunk in stream:
+                                ai_response += chunk
+                                stream_placeholder.markdown(
+                                    user_bubble + render_chat_bubble("assistant", ai_response),
+                                    unsafe_allow_html=True
+                                )
                     
-                    # 重新運行以更新聊天記錄（會自動滾動）
-                    st.rerun()
+                    # 串流結束後才寫入記錄；下次重新執行時會併入上方聊天記錄
+                    st.session_state.chat_messages.append({"role": "assistant", "content": ai_response})
             except Exception as e:
                 st.error(f"❌ Chat Error: {str(e)}")
                 import traceback
@@ -1521,6 +1563,47 @@ with tab_convert:
                 except Exception as e:
                     st.error(f"{get_text('convert_failed')}: {str(e)}")
 
+with tab_results:
+    st.header(get_text("results_title"))
+    # 每次重新執行各自開啟連線：sqlite 連線不可由多個 session 執行緒同時使用
+    with ResultsStore() as store:
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            if st.button(get_text("results_ingest_btn"), key="results_ingest_btn", type="primary"):
+                with st.spinner(get_text("results_ingest_btn")):
+                    counts = store.ingest_directory()
+                st.success(get_text("results_ingested").format(**counts))
+        with col2:
+            results_lang = st.selectbox(
+                get_text("results_lang"),
+                [get_text("results_lang_all"), *RESULT_LANGUAGES],
+                key="results_lang"
+            )
+        results_lang = None if results_lang == get_text("results_lang_all") else results_lang
+
+        runs = store.list_runs(results_lang)
+        if not runs:
+            st.info(get_text("results_empty"))
+        else:
+            st.subheader(get_text("results_runs"))
+            st.dataframe(runs, use_container_width=True, hide_index=True)
+
+            label_summary = store.label_summary(results_lang)
+            if label_summary:
+                st.subheader(get_text("results_label_summary"))
+                st.dataframe(label_summary, use_container_width=True, hide_index=True)
+
+            comparisons = store.comparison_summary(results_lang)
+            if comparisons:
+                st.subheader(get_text("results_comparisons"))
+                st.dataframe(comparisons, use_container_width=True, hide_index=True)
+
+            st.divider()
+            results_qid = st.text_input(get_text("results_qid_lookup"), key="results_qid").strip().upper()
+            if results_qid:
+                st.dataframe(store.question_across_runs(results_qid, results_lang),
+                             use_container_width=True, hide_index=True)
+
 # ==============================
 # 底部信息
 # ==============================
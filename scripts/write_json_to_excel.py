@@ -2,7 +2,9 @@ import json
 import sys
 import argparse
 import os
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+
+from results_store import ResultsStore
 
 
 # 多語系欄位配置
@@ -51,84 +53,44 @@ def detect_language(headers):
     return "zh-TW"  # 預設繁體中文
 
 
-def write_json_to_excel(excel_path: str, json_path: str) -> None:
-    """讀 JSON 並寫入既有 Excel"""
-
-    # 路徑標準化處理
-    excel_path = os.path.abspath(excel_path)
-    json_path = os.path.abspath(json_path)
-
-    if not os.path.isfile(excel_path):
-        print(f"找不到 Excel 檔案: {excel_path}")
-        return
-
-    if not os.path.isfile(json_path):
-        print(f"找不到 JSON 檔案: {json_path}")
-        return
-
-    # （目前不建立備份，輸出為新檔案 _output.xlsx）
-
-    # 載入 JSON（更健壯的辨識：支援 dict 包含 list、list of json-strings）
-    with open(json_path, "r", encoding="utf-8") as f:
-        json_data = json.load(f)
-
-    # 決定要遍歷的資料清單
-    data_list = None
+def find_data_list(obj, depth=0):
+    """遞迴搜尋可用的 list of dicts（支援 dict 包含 list、list of json-strings）"""
+    if depth > 5:  # 防止無限遞迴
+        return None
     
-    # 遞迴函數：深層搜索
-    def find_data_list(obj, depth=0):
-        """遞迴搜尋可用的 list of dicts"""
-        if depth > 5:  # 防止無限遞迴
-            return None
-        
-        if isinstance(obj, list):
-            # 檢查是否是 list of dicts
-            if len(obj) > 0 and all(isinstance(x, dict) for x in obj[:10]):
-                return obj
-            # 檢查是否是 list of json-strings
-            if len(obj) > 0 and all(isinstance(x, str) for x in obj[:10]):
-                parsed = []
-                for s in obj:
-                    try:
-                        parsed.append(json.loads(s))
-                    except Exception:
-                        continue
-                if parsed and all(isinstance(x, dict) for x in parsed[:10]):
-                    return parsed
-        
-        elif isinstance(obj, dict):
-            # 先檢查直接的 list values
-            for k, v in obj.items():
-                if isinstance(v, list) and len(v) > 0 and all(isinstance(x, dict) for x in v[:10]):
-                    return v
-            
-            # 再遞迴進入 dict values（尋找深層的 list）
-            for k, v in obj.items():
-                if isinstance(v, dict):
-                    result = find_data_list(v, depth + 1)
-                    if result is not None:
-                        return result
+    if isinstance(obj, list):
+        # 檢查是否是 list of dicts
+        if len(obj) > 0 and all(isinstance(x, dict) for x in obj[:10]):
+            return obj
+        # 檢查是否是 list of json-strings
+        if len(obj) > 0 and all(isinstance(x, str) for x in obj[:10]):
+            parsed = []
+            for s in obj:
+                try:
+                    parsed.append(json.loads(s))
+                except Exception:
+                    continue
+            if parsed and all(isinstance(x, dict) for x in parsed[:10]):
+                return parsed
+    
+    elif isinstance(obj, dict):
+        # 先檢查直接的 list values
+        for k, v in obj.items():
+            if isinstance(v, list) and len(v) > 0 and all(isinstance(x, dict) for x in v[:10]):
+                return v
         
-        return None
+        # 再遞迴進入 dict values（尋找深層的 list）
+        for k, v in obj.items():
+            if isinstance(v, dict):
+                result = find_data_list(v, depth + 1)
+                if result is not None:
+                    return result
     
-    data_list = find_data_list(json_data)
-
-    if data_list is None:
-        print("無法判別 JSON 結構（找不到可用的 list of dicts）")
-        return
-
-    # 載入 Excel
-    wb = load_workbook(excel_path)
-    ws = wb.active
+    return None
 
-    # 找欄位
-    headers = {}
-    for col in range(1, ws.max_column + 1):
-        key = ws.cell(row=1, column=col).value
-        if key:
-            headers[key] = col
 
-    # 偵測語系
+def resolve_config(headers):
+    """依欄位偵測語系並檢查必要欄位，缺少題號或分類欄位時回傳 None"""
     lang = detect_language(headers)
     config = LANGUAGE_FIELDS[lang]
     print(f"偵測到語系: {lang}")
@@ -139,20 +101,39 @@ def write_json_to_excel(excel_path: str, json_path: str) -> None:
     
     if qid_field not in headers:
         print(f"Excel 缺少必要欄位: {qid_field}")
-        return
+        return None
     
     # 檢查至少有一個分類欄位
     has_classification = any(f in headers for f in classification_fields)
     if not has_classification:
         print(f"Excel 缺少分類欄位 (需要至少一個): {', '.join(classification_fields)}")
-        return
+        return None
     
     # 提示缺少的可選欄位
     missing_fields = [f for f in required_fields if f not in headers]
     if missing_fields:
         print(f"警告：Excel 缺少某些欄位 (會跳過): {', '.join(missing_fields)}")
+    return config
 
-    # 寫入資料
+
+def build_qid_index(qid_values, first_row: int = 2) -> dict:
+    """單次掃描題號欄建立 題號 → 列號 索引（重複題號以第一列為準）"""
+    index = {}
+    for row, cell_val in enumerate(qid_values, first_row):
+        if cell_val is None:
+            continue
+        index.setdefault(str(cell_val).strip(), row)
+    return index
+
+
+def collect_updates(data_list, headers: dict, qid_field: str, qid_index: dict):
+    """
+    彙整所有寫入：{列號: {欄號: 值}}（同一題出現多次時後者覆蓋前者）
+
+    Returns:
+        (updates, written_count)
+    """
+    updates = {}
     written_count = 0
     for item in data_list:
         if not isinstance(item, dict):
@@ -162,39 +143,168 @@ def write_json_to_excel(excel_path: str, json_path: str) -> None:
         if not qid:
             continue
 
-        target_row = None
-        for row in range(2, ws.max_row + 1):
-            cell_val = ws.cell(row=row, column=headers[qid_field]).value
-            if cell_val is None:
-                continue
-            if str(cell_val).strip() == str(qid).strip():
-                target_row = row
-                break
-
+        target_row = qid_index.get(str(qid).strip())
         if not target_row:
             # print(f"{qid_field} {qid} 找不到，略過")
             continue
 
+        row_updates = updates.setdefault(target_row, {})
         for key, value in item.items():
             if key in headers:
-                ws.cell(row=target_row, column=headers[key]).value = value
+                row_updates[headers[key]] = value
         
         written_count += 1
+    return updates, written_count
+
+
+def _write_styled(excel_path: str, output_path: str, data_list) -> int:
+    """載入完整模板（保留樣式）後原地更新，回傳寫入筆數；欄位不符時回傳 None"""
+    wb = load_workbook(excel_path)
+    ws = wb.active
+
+    # 找欄位
+    headers = {}
+    for col in range(1, ws.max_column + 1):
+        key = ws.cell(row=1, column=col).value
+        if key:
+            headers[key] = col
+
+    config = resolve_config(headers)
+    if config is None:
+        return None
+    qid_field = config["qid_field"]
+
+    qid_col = headers[qid_field]
+    qid_values = (row[0] for row in ws.iter_rows(min_row=2, min_col=qid_col, max_col=qid_col, values_only=True))
+    updates, written_count = collect_updates(data_list, headers, qid_field, build_qid_index(qid_values))
+
+    for row, row_updates in updates.items():
+        for col, value in row_updates.items():
+            ws.cell(row=row, column=col).value = value
+
+    wb.save(output_path)
+    return written_count
+
+
+def _write_streaming(excel_path: str, output_path: str, data_list) -> int:
+    """
+    不需要模板樣式時的快速路徑：以 read-only 模式串流讀取，
+    再以 write-only 模式逐列寫出新活頁簿（只保留儲存格內容與公式）
+    """
+    src = load_workbook(excel_path, read_only=True)
+    try:
+        src_ws = src.active
+        # 部分工具產生的檔案記錄的範圍不正確，改為讀到實際最後一列
+        src_ws.reset_dimensions()
+        rows = [list(row) for row in src_ws.iter_rows(values_only=True)]
+        title = src_ws.title
+    finally:
+        src.close()
+    if not rows:
+        print("Excel 沒有任何資料列")
+        return None
+
+    headers = {}
+    for col, key in enumerate(rows[0], 1):
+        if key:
+            headers[key] = col
+
+    config = resolve_config(headers)
+    if config is None:
+        return None
+    qid_field = config["qid_field"]
+
+    qid_col = headers[qid_field]
+    qid_values = (row[qid_col - 1] if len(row) >= qid_col else None for row in rows[1:])
+    updates, written_count = collect_updates(data_list, headers, qid_field, build_qid_index(qid_values))
+
+    for row, row_updates in updates.items():
+        values = rows[row - 1]
+        width = max(row_updates)
+        if len(values) < width:
+            values.extend([None] * (width - len(values)))
+        for col, value in row_updates.items():
+            values[col - 1] = value
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    for values in rows:
+        ws.append(values)
+    wb.save(output_path)
+    return written_count
+
+
+def write_json_to_excel(excel_path: str, json_path: str = None, write_only: bool = False,
+                        run_key: str = None) -> None:
+    """
+    讀 JSON（或測試結果資料庫中某次執行的標註）並寫入既有 Excel
+
+    Args:
+        excel_path: Excel 模板路徑
+        json_path: JSON 資料路徑
+        write_only: 不保留模板樣式，改以 write-only 模式串流寫出（大檔案較快）
+        run_key: 改由測試結果資料庫讀取此執行的標註（如 zh-TW/qwen25_behavior_v4）
+    """
+
+    # 路徑標準化處理
+    excel_path = os.path.abspath(excel_path)
+
+    if not os.path.isfile(excel_path):
+        print(f"找不到 Excel 檔案: {excel_path}")
+        return
+
+    # （目前不建立備份，輸出為新檔案 _output.xlsx）
+
+    if run_key:
+        store = ResultsStore()
+        try:
+            data_list = store.get_labels(run_key) or None
+        finally:
+            store.close()
+        if data_list is None:
+            print(f"測試結果資料庫中沒有此執行的標註: {run_key}")
+            return
+    else:
+        json_path = os.path.abspath(json_path)
+        if not os.path.isfile(json_path):
+            print(f"找不到 JSON 檔案: {json_path}")
+            return
+
+        # 載入 JSON
+        with open(json_path, "r", encoding="utf-8") as f:
+            json_data = json.load(f)
+
+        # 決定要遍歷的資料清單
+        data_list = find_data_list(json_data)
+
+    if data_list is None:
+        print("無法判別 JSON 結構（找不到可用的 list of dicts）")
+        return
 
     # 自動輸出
     output_path = excel_path.replace(".xlsx", "_output.xlsx")
 
-    wb.save(output_path)
+    if write_only:
+        written_count = _write_streaming(excel_path, output_path, data_list)
+    else:
+        written_count = _write_styled(excel_path, output_path, data_list)
+    if written_count is None:
+        return
+
     print(f"完成：已寫入 {written_count} 筆資料到 {output_path}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="將 JSON 寫入 Excel")
     parser.add_argument("--excel", required=True, help="Excel 模板檔案路徑")
-    parser.add_argument("--json", required=True, help="JSON 資料檔案路徑")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--json", help="JSON 資料檔案路徑")
+    source.add_argument("--run", help="改由測試結果資料庫讀取此執行的標註（如 zh-TW/qwen25_behavior_v4）")
+    parser.add_argument("--write-only", action="store_true",
+                        help="不保留模板樣式，以 write-only 模式串流寫出新檔（大檔案較快）")
 
     args = parser.parse_args()
-    write_json_to_excel(args.excel, args.json)
+    write_json_to_excel(args.excel, args.json, write_only=args.write_only, run_key=args.run)
 
 
 if __name__ == "__main__":
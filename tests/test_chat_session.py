@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("peft")
+tokenizers = pytest.importorskip("tokenizers")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from chat import ChatSession
+
+SPECIAL_TOKENS = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+
+
+def _tiny_tokenizer():
+    words = ["system", "user", "assistant", "sys", "hello", "again", "more"]
+    words += [f"w{i}" for i in range(40)]
+    vocab = {token: i for i, token in enumerate(SPECIAL_TOKENS + words + ["[UNK]"])}
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    backend.add_special_tokens(SPECIAL_TOKENS)
+    return transformers.PreTrainedTokenizerFast(
+        tokenizer_object=backend, eos_token="<|im_end|>", pad_token="<|endoftext|>",
+    )
+
+
+@pytest.fixture(scope="module")
+def tokenizer_and_model():
+    tokenizer = _tiny_tokenizer()
+    torch.manual_seed(0)
+    config = transformers.Qwen2Config(
+        vocab_size=len(tokenizer), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=1024,
+    )
+    model = transformers.Qwen2ForCausalLM(config).eval()
+    return tokenizer, model
+
+
+def _session(tokenizer, model):
+    # min_new_tokens 讓回覆固定長度，串流中途一定還有尚未生成的內容
+    return ChatSession(tokenizer, model, "zh-TW", system_prompt="sys",
+                       max_new_tokens=24, min_new_tokens=24, do_sample=False)
+
+
+def test_closed_stream_does_not_record_partial_turn(tokenizer_and_model):
+    tokenizer, model = tokenizer_and_model
+    session = _session(tokenizer, model)
+    session.ask("hello")
+    history, length = list(session.history), session.context_length
+
+    stream = session.ask_stream("again")
+    next(stream)
+    stream.close()
+
+    assert session.history == history
+    assert session.context_length == length
+
+    # 中止後的下一輪與從未中止的對話結果相同（cache 已裁回）
+    reference = _session(tokenizer, model)
+    reference.ask("hello")
+    assert session.ask("more") == reference.ask("more")
+
+
+def test_finished_stream_records_turn(tokenizer_and_model):
+    tokenizer, model = tokenizer_and_model
+    session = _session(tokenizer, model)
+
+    reply = "".join(session.ask_stream("hello"))
+
+    assert len(session.history) == 1
+    assert session.history[0][0] == "hello"
+    assert reply.strip() == session.history[0][1]
@@ -0,0 +1,65 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from compare_with_standards import (
+    DIMENSIONS, load_dimension_matrix, paired_permutation_test, records_by_qid, score_models,
+)
+
+
+def test_unanswered_question_is_not_disagreement():
+    standard = np.array([[1, 0, 0, 0, 1, 0], [0, 1, 0, 0, 0, 1]], dtype=np.int8)
+    predictions = np.repeat(standard[None], 4, axis=0)
+    answered = np.ones((4, 2), dtype=bool)
+    answered[3, 1] = False  # 最後一個模型沒有回答第 2 題
+
+    scores = score_models(standard, predictions, answered)
+
+    assert scores["error_rate"].tolist() == [0, 0]
+    assert not scores["disagreement"].any()
+    assert scores["answered_count"].tolist() == [2, 2, 2, 1]
+
+
+def test_answering_models_disagree():
+    standard = np.zeros((1, len(DIMENSIONS)), dtype=np.int8)
+    predictions = np.zeros((3, 1, len(DIMENSIONS)), dtype=np.int8)
+    predictions[1, 0, 0] = 1
+    answered = np.array([[True], [True], [False]])
+
+    scores = score_models(standard, predictions, answered)
+
+    assert scores["disagreement"][0].tolist() == [True] + [False] * (len(DIMENSIONS) - 1)
+
+
+def test_duplicate_qid_keeps_first_record(capsys):
+    first = {"qid": "q1", "is_reject": 1}
+    records = [first, {"qid": "q2", "is_clarify": 1}, {"qid": "q1", "is_deny": 1}]
+
+    # 單檔與跨模型路徑都經過 load_dimension_matrix，重複題號一律保留第一筆
+    labels, answered = load_dimension_matrix(records, ["q1", "q2"], source="model-a")
+
+    assert labels[0].tolist() == [1, 0, 0, 0, 0, 0]
+    assert answered.tolist() == [True, True]
+    assert "model-a" in capsys.readouterr().out
+    assert records_by_qid(records)["q1"] is first
+
+
+def test_permutation_test_without_shared_questions():
+    empty = np.zeros((0, len(DIMENSIONS)), dtype=bool)
+
+    results = paired_permutation_test(empty, empty, n_permutations=100, workers=1)
+
+    assert all(r == {"difference": None, "p_value": None} for r in results.values())
+
+
+def test_permutation_test_identical_models():
+    correct = np.random.default_rng(0).random((50, len(DIMENSIONS))) < 0.8
+
+    results = paired_permutation_test(correct, correct, n_permutations=200, workers=1)
+
+    assert all(r["p_value"] == 1.0 for r in results.values())